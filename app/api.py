@@ -1,18 +1,61 @@
 from fastapi import FastAPI, Depends, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Dict, List, Literal, Optional
+from datetime import date
+from contextlib import asynccontextmanager
+import threading
+import time
+from sqlalchemy import text
 from sqlalchemy.orm import Session
+from app.concurrency import Overloaded, RequestPool
 from app.config import get_settings
-from app.models import get_db, Document
+from app.models import get_db, Document, SessionLocal
+from retrieval.metrics import StageTimer, render_metrics
 from retrieval.search import get_search_engine
 
 settings = get_settings()
 
+MAX_QUERY_LENGTH = 500
+
+_warmup_error = None
+
+# searches are CPU-bound, so they get a pool sized to the machine instead of
+# Starlette's shared 40-thread default, and are shed once it falls behind
+search_pool = RequestPool(settings.API_WORKER_THREADS, settings.API_MAX_QUEUED, name="search")
+
+
+def _warmup():
+    global _warmup_error
+    db = SessionLocal()
+    try:
+        get_search_engine().warmup(db)
+    except Exception as e:
+        _warmup_error = str(e)
+        print(f"Warmup failed: {_warmup_error}")
+    finally:
+        db.close()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if settings.WARMUP_ON_STARTUP:
+        # off the event loop, so /health answers while the model and index load
+        threading.Thread(target=_warmup, name="warmup", daemon=True).start()
+    yield
+    # write out queued search logs before the process exits
+    log_writer = get_search_engine().log_writer
+    if log_writer is not None:
+        log_writer.close()
+
+
 app = FastAPI(
     title=settings.API_TITLE,
     version=settings.API_VERSION,
-    description=settings.API_DESCRIPTION
+    description=settings.API_DESCRIPTION,
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -25,8 +68,45 @@ app.add_middleware(
 
 
 class SearchRequest(BaseModel):
-    query: str = Field(..., min_length=1, max_length=500)
+    query: str = Field(..., min_length=1, max_length=MAX_QUERY_LENGTH)
     top_k: int = Field(default=5, ge=1, le=settings.MAX_TOP_K)
+    categories: Optional[List[str]] = Field(default=None, description="Match papers in any of these arXiv categories")
+    date_from: Optional[date] = Field(default=None, description="Earliest publication date, inclusive")
+    date_to: Optional[date] = Field(default=None, description="Latest publication date, inclusive")
+    mode: Literal["dense", "lexical", "hybrid"] = Field(
+        default=settings.SEARCH_MODE, description="Dense (FAISS), lexical (BM25) or hybrid (reciprocal-rank fusion)"
+    )
+    rerank: bool = Field(default=settings.CROSS_ENCODER_ENABLED, description="Re-order candidates with the cross-encoder")
+    debug: bool = Field(default=False, description="Include a per-stage latency breakdown")
+
+
+class BatchQuery(BaseModel):
+    # checked per query in the handler, so one bad entry does not reject the batch
+    query: str
+    top_k: int = 5
+
+
+class BatchSearchRequest(BaseModel):
+    queries: List[BatchQuery] = Field(..., min_length=1, max_length=settings.SEARCH_BATCH_MAX_QUERIES)
+    categories: Optional[List[str]] = Field(default=None, description="Match papers in any of these arXiv categories")
+    date_from: Optional[date] = Field(default=None, description="Earliest publication date, inclusive")
+    date_to: Optional[date] = Field(default=None, description="Latest publication date, inclusive")
+    mode: Literal["dense", "lexical", "hybrid"] = Field(
+        default=settings.SEARCH_MODE, description="Dense (FAISS), lexical (BM25) or hybrid (reciprocal-rank fusion)"
+    )
+    rerank: bool = Field(default=settings.CROSS_ENCODER_ENABLED, description="Re-order candidates with the cross-encoder")
+
+
+class ExportRequest(BaseModel):
+    query: str = Field(..., min_length=1, max_length=MAX_QUERY_LENGTH)
+    limit: int = Field(default=1000, ge=1, le=settings.EXPORT_MAX_RESULTS, description="Depth of the ranking")
+    page_size: int = Field(default=100, ge=1, le=settings.EXPORT_CHUNK_SIZE, description="Results per page (pages only)")
+    categories: Optional[List[str]] = Field(default=None, description="Match papers in any of these arXiv categories")
+    date_from: Optional[date] = Field(default=None, description="Earliest publication date, inclusive")
+    date_to: Optional[date] = Field(default=None, description="Latest publication date, inclusive")
+    mode: Literal["dense", "lexical", "hybrid"] = Field(
+        default=settings.SEARCH_MODE, description="Dense (FAISS), lexical (BM25) or hybrid (reciprocal-rank fusion)"
+    )
 
 
 class SearchResult(BaseModel):
@@ -39,6 +119,7 @@ class SearchResult(BaseModel):
     published_date: Optional[str]
     pdf_url: Optional[str]
     score: float
+    rerank_score: Optional[float] = None
     rank: int
 
 
@@ -47,6 +128,27 @@ class SearchResponse(BaseModel):
     results: List[SearchResult]
     total_results: int
     latency_ms: float
+    timings_ms: Optional[Dict[str, float]] = None
+
+
+class BatchSearchItem(BaseModel):
+    query: str
+    results: List[SearchResult] = []
+    total_results: int = 0
+    error: Optional[str] = None
+
+
+class BatchSearchResponse(BaseModel):
+    results: List[BatchSearchItem]
+    total_queries: int
+    failed_queries: int
+    latency_ms: float
+
+
+class ResultPage(BaseModel):
+    results: List[SearchResult]
+    total_results: int
+    next_cursor: Optional[str] = None
 
 
 @app.get("/")
@@ -54,30 +156,178 @@ async def root():
     return {"status": "healthy", "version": settings.API_VERSION}
 
 
+def _search(request: SearchRequest, db: Session) -> SearchResponse:
+    search_engine = get_search_engine()
+    timer = StageTimer()
+    results, latency_ms = search_engine.search(
+        query=request.query,
+        top_k=request.top_k,
+        db=db,
+        log_search=True,
+        categories=request.categories,
+        date_from=request.date_from,
+        date_to=request.date_to,
+        mode=request.mode,
+        rerank=request.rerank,
+        timer=timer
+    )
+
+    return SearchResponse(
+        query=request.query,
+        results=results,
+        total_results=len(results),
+        latency_ms=latency_ms,
+        timings_ms=timer.breakdown_ms() if request.debug else None
+    )
+
+
+# concurrent searches overlap on the pool, so their query embeddings can still be
+# coalesced into one batch
 @app.post("/search", response_model=SearchResponse)
 async def search(request: SearchRequest, db: Session = Depends(get_db)):
     try:
-        search_engine = get_search_engine()
-        results, latency_ms = search_engine.search(
-            query=request.query,
-            top_k=request.top_k,
-            db=db,
-            log_search=True
-        )
-        
-        return SearchResponse(
-            query=request.query,
-            results=results,
-            total_results=len(results),
-            latency_ms=latency_ms
-        )
+        return await search_pool.run(_search, request, db)
+    except Overloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
 
 
+def _validate_batch_query(item: BatchQuery) -> Optional[str]:
+    if not 1 <= len(item.query) <= MAX_QUERY_LENGTH:
+        return f"query must be 1-{MAX_QUERY_LENGTH} characters"
+    if not 1 <= item.top_k <= settings.MAX_TOP_K:
+        return f"top_k must be between 1 and {settings.MAX_TOP_K}"
+    return None
+
+
+def _search_batch(request: BatchSearchRequest, db: Session) -> BatchSearchResponse:
+    search_engine = get_search_engine()
+    filters = dict(
+        db=db, log_search=True, categories=request.categories, date_from=request.date_from,
+        date_to=request.date_to, mode=request.mode, rerank=request.rerank
+    )
+    items = [BatchSearchItem(query=item.query, error=_validate_batch_query(item)) for item in request.queries]
+    valid = [i for i, item in enumerate(items) if item.error is None]
+
+    start_time = time.perf_counter()
+    if valid:
+        try:
+            all_results, _ = search_engine.search_batch(
+                [request.queries[i].query for i in valid], top_k=[request.queries[i].top_k for i in valid], **filters
+            )
+        except Exception:
+            # rerun one by one so a failure is pinned on the query that caused it
+            all_results = []
+            for i in valid:
+                try:
+                    all_results.append(search_engine.search(request.queries[i].query, top_k=request.queries[i].top_k, **filters)[0])
+                except Exception as e:
+                    all_results.append(None)
+                    items[i].error = f"Search failed: {str(e)}"
+        for i, results in zip(valid, all_results):
+            if results is not None:
+                items[i] = BatchSearchItem(query=items[i].query, results=results, total_results=len(results))
+
+    return BatchSearchResponse(
+        results=items,
+        total_queries=len(items),
+        failed_queries=sum(item.error is not None for item in items),
+        latency_ms=(time.perf_counter() - start_time) * 1000
+    )
+
+
+# one encode, one FAISS search and one metadata fetch for the whole batch
+@app.post("/search/batch", response_model=BatchSearchResponse)
+async def search_batch(request: BatchSearchRequest, db: Session = Depends(get_db)):
+    try:
+        return await search_pool.run(_search_batch, request, db)
+    except Overloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+def _export_ranking(request: ExportRequest, db: Session) -> str:
+    return get_search_engine().rank_for_export(
+        request.query, request.limit, db, categories=request.categories,
+        date_from=request.date_from, date_to=request.date_to, mode=request.mode
+    )
+
+
+def _load_ranking(token: str):
+    ranking = get_search_engine().ranked_ids.get(token)
+    if ranking is None:
+        raise HTTPException(status_code=410, detail="Cursor expired; start the export again")
+    return ranking
+
+
+def _page(token: str, offset: int, page_size: int, db: Session) -> ResultPage:
+    doc_ids, scores = _load_ranking(token)
+    results = get_search_engine().ranked_page(doc_ids, scores, offset, page_size, db)
+    next_offset = offset + page_size
+    return ResultPage(
+        results=results,
+        total_results=len(doc_ids),
+        next_cursor=f"{token}.{next_offset}" if next_offset < len(doc_ids) else None
+    )
+
+
+def _first_page(request: ExportRequest, db: Session) -> ResultPage:
+    return _page(_export_ranking(request, db), 0, request.page_size, db)
+
+
+def _stream_ranking(doc_ids, scores, db: Session):
+    # one chunk of rows is hydrated and serialised at a time, so memory stays
+    # flat however deep the ranking goes
+    search_engine = get_search_engine()
+    for offset in range(0, len(doc_ids), settings.EXPORT_CHUNK_SIZE):
+        results = search_engine.ranked_page(doc_ids, scores, offset, settings.EXPORT_CHUNK_SIZE, db)
+        yield "".join(SearchResult(**result).model_dump_json() + "\n" for result in results)
+
+
+async def _run_export(fn, *args):
+    try:
+        return await search_pool.run(fn, *args)
+    except Overloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Export failed: {str(e)}")
+
+
+@app.post("/search/export")
+async def export_search(request: ExportRequest, db: Session = Depends(get_db)):
+    token = await _run_export(_export_ranking, request, db)
+    doc_ids, scores = _load_ranking(token)
+    return StreamingResponse(
+        _stream_ranking(doc_ids, scores, db),
+        media_type="application/x-ndjson",
+        headers={"X-Total-Results": str(len(doc_ids)), "X-Cursor": f"{token}.0"}
+    )
+
+
+@app.post("/search/pages", response_model=ResultPage)
+async def first_result_page(request: ExportRequest, db: Session = Depends(get_db)):
+    return await _run_export(_first_page, request, db)
+
+
+@app.get("/search/pages", response_model=ResultPage)
+async def next_result_page(
+    cursor: str,
+    page_size: int = Query(default=100, ge=1, le=settings.EXPORT_CHUNK_SIZE),
+    db: Session = Depends(get_db)
+):
+    token, _, offset = cursor.partition(".")
+    if not offset.isdigit():
+        raise HTTPException(status_code=400, detail="Malformed cursor")
+    return await _run_export(_page, token, int(offset), page_size, db)
+
+
 @app.get("/documents/{arxiv_id}")
 async def get_document(arxiv_id: str, db: Session = Depends(get_db)):
-    document = db.query(Document).filter(Document.arxiv_id == arxiv_id).first()
+    document = await run_in_threadpool(
+        lambda: db.query(Document).filter(Document.arxiv_id == arxiv_id).first()
+    )
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
     return document.to_dict()
@@ -85,24 +335,46 @@ async def get_document(arxiv_id: str, db: Session = Depends(get_db)):
 
 @app.get("/stats")
 async def get_stats():
-    search_engine = get_search_engine()
-    return search_engine.get_index_stats()
+    stats = await run_in_threadpool(get_search_engine().get_index_stats)
+    stats["request_pool"] = search_pool.stats()
+    return stats
 
 
-@app.get("/health")
-async def health_check(db: Session = Depends(get_db)):
+def _health(db: Session):
     try:
-        db.execute("SELECT 1")
+        db.execute(text("SELECT 1"))
         db_status = "connected"
     except Exception as e:
         db_status = f"error: {str(e)}"
-    
+
     search_engine = get_search_engine()
-    index_size = search_engine.faiss_index.size
-    
+    faiss_index = search_engine.faiss_index
+
     return {
         "status": "healthy" if db_status == "connected" else "degraded",
         "version": settings.API_VERSION,
         "database": db_status,
-        "index_size": index_size
+        "index_size": faiss_index.size,
+        "index_version": faiss_index.version
     }
+
+
+# not on the search pool, so health checks still answer while searches are shed
+@app.get("/health")
+async def health_check(db: Session = Depends(get_db)):
+    return await run_in_threadpool(_health, db)
+
+
+@app.get("/metrics")
+async def metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
+@app.get("/ready")
+async def readiness_check():
+    if _warmup_error is not None:
+        return JSONResponse(status_code=503, content={"status": "failed", "error": _warmup_error})
+    if settings.WARMUP_ON_STARTUP and not get_search_engine().ready:
+        return JSONResponse(status_code=503, content={"status": "warming_up"})
+    return {"status": "ready"}
@@ -0,0 +1,81 @@
+import asyncio
+import functools
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+from retrieval.metrics import REQUEST_QUEUE_DEPTH, REQUESTS_SHED
+
+
+class Overloaded(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"Server busy, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class RequestPool:
+    # Runs blocking request work (query encoding, FAISS, psycopg2) on a fixed set
+    # of threads so the event loop only schedules. Once max_queued admitted
+    # requests are already waiting for a thread, run() sheds new ones with
+    # Overloaded instead of letting latency grow without bound; retry_after is
+    # how long the current queue should take to drain at the recent pace.
+
+    def __init__(self, workers: int, max_queued: int, name: str = "request"):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.active = 0
+        self.completed = 0
+        self.shed = 0
+        self.seconds_per_request = None
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+
+    @property
+    def queued(self) -> int:
+        return max(0, self.active - self.workers)
+
+    def retry_after(self) -> int:
+        per_request = self.seconds_per_request or 1.0
+        return max(1, math.ceil((self.queued + 1) * per_request / self.workers))
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        with self._lock:
+            if self.queued >= self.max_queued:
+                self.shed += 1
+                REQUESTS_SHED.inc()
+                raise Overloaded(self.retry_after())
+            self.active += 1
+            REQUEST_QUEUE_DEPTH.set(self.queued)
+
+        # counted down when the thread finishes, not when the caller stops
+        # waiting, so a disconnected client still holds its slot until then
+        future = self._executor.submit(self._timed, functools.partial(fn, *args, **kwargs))
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def _timed(self, call: Callable) -> Any:
+        started = time.perf_counter()
+        try:
+            return call()
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.seconds_per_request = elapsed if self.seconds_per_request is None else 0.8 * self.seconds_per_request + 0.2 * elapsed
+
+    def _release(self, future):
+        with self._lock:
+            self.active -= 1
+            self.completed += 1
+            REQUEST_QUEUE_DEPTH.set(self.queued)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "active": self.active,
+            "queued": self.queued,
+            "max_queued": self.max_queued,
+            "completed": self.completed,
+            "shed": self.shed,
+            "ms_per_request": self.seconds_per_request * 1000 if self.seconds_per_request else None,
+        }
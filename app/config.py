@@ -11,7 +11,61 @@ class Settings(BaseSettings):
     POSTGRES_PASSWORD: str = os.getenv("POSTGRES_PASSWORD", "scholar123")
     EMBEDDING_MODEL: str = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
     EMBEDDING_DIM: int = 384
+    EMBEDDING_BACKEND: str = os.getenv("EMBEDDING_BACKEND", "torch")
+    EMBEDDING_ONNX_DIR: str = os.getenv("EMBEDDING_ONNX_DIR", "models/onnx")
+    EMBEDDING_ONNX_QUANTIZATION: str = os.getenv("EMBEDDING_ONNX_QUANTIZATION", "avx2")
+    EMBEDDING_BATCH_TOKENS: int = int(os.getenv("EMBEDDING_BATCH_TOKENS", "8192"))
+    EMBEDDING_WORKERS: int = int(os.getenv("EMBEDDING_WORKERS", "1"))
+    EMBEDDING_CACHE_PATH: str = os.getenv("EMBEDDING_CACHE_PATH", "data/embedding_cache.sqlite")
+    EMBEDDING_CACHE_MAX_ENTRIES: int = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "1000000"))
+    QUERY_BATCH_WINDOW_MS: float = float(os.getenv("QUERY_BATCH_WINDOW_MS", "2"))
+    QUERY_BATCH_MAX_SIZE: int = int(os.getenv("QUERY_BATCH_MAX_SIZE", "64"))
+    QUERY_CACHE_SIZE: int = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+    QUERY_CACHE_TTL: float = float(os.getenv("QUERY_CACHE_TTL", "3600"))
     FAISS_INDEX_PATH: str = os.getenv("FAISS_INDEX_PATH", "data/faiss_index")
+    FAISS_INDEX_TYPE: str = os.getenv("FAISS_INDEX_TYPE", "flat")
+    FAISS_NLIST: int = int(os.getenv("FAISS_NLIST", "1024"))
+    FAISS_NPROBE: int = int(os.getenv("FAISS_NPROBE", "16"))
+    FAISS_HNSW_M: int = int(os.getenv("FAISS_HNSW_M", "32"))
+    FAISS_HNSW_EF_CONSTRUCTION: int = int(os.getenv("FAISS_HNSW_EF_CONSTRUCTION", "200"))
+    FAISS_EF_SEARCH: int = int(os.getenv("FAISS_EF_SEARCH", "64"))
+    FAISS_PQ_M: int = int(os.getenv("FAISS_PQ_M", "48"))
+    FAISS_PQ_NBITS: int = int(os.getenv("FAISS_PQ_NBITS", "8"))
+    FAISS_RERANK: bool = os.getenv("FAISS_RERANK", "true").lower() == "true"
+    FAISS_RERANK_FACTOR: int = int(os.getenv("FAISS_RERANK_FACTOR", "4"))
+    FAISS_OMP_THREADS: int = int(os.getenv("FAISS_OMP_THREADS", "1"))
+    FAISS_NUM_SHARDS: int = int(os.getenv("FAISS_NUM_SHARDS", "1"))
+    FAISS_MMAP: bool = os.getenv("FAISS_MMAP", "true").lower() == "true"
+    FAISS_RELOAD_INTERVAL: float = float(os.getenv("FAISS_RELOAD_INTERVAL", "5"))
+    FAISS_KEEP_SNAPSHOTS: int = int(os.getenv("FAISS_KEEP_SNAPSHOTS", "2"))
+    SEARCH_MODE: str = os.getenv("SEARCH_MODE", "dense")
+    BM25_K1: float = float(os.getenv("BM25_K1", "1.2"))
+    BM25_B: float = float(os.getenv("BM25_B", "0.75"))
+    RRF_K: int = int(os.getenv("RRF_K", "60"))
+    HYBRID_CANDIDATES: int = int(os.getenv("HYBRID_CANDIDATES", "50"))
+    CROSS_ENCODER_ENABLED: bool = os.getenv("CROSS_ENCODER_ENABLED", "false").lower() == "true"
+    CROSS_ENCODER_MODEL: str = os.getenv("CROSS_ENCODER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+    CROSS_ENCODER_CANDIDATES: int = int(os.getenv("CROSS_ENCODER_CANDIDATES", "30"))
+    CROSS_ENCODER_BATCH_SIZE: int = int(os.getenv("CROSS_ENCODER_BATCH_SIZE", "16"))
+    CROSS_ENCODER_BUDGET_MS: float = float(os.getenv("CROSS_ENCODER_BUDGET_MS", "200"))
+    CROSS_ENCODER_CACHE_SIZE: int = int(os.getenv("CROSS_ENCODER_CACHE_SIZE", "20000"))
+    RESPONSE_CACHE_BACKEND: str = os.getenv("RESPONSE_CACHE_BACKEND", "memory")
+    RESPONSE_CACHE_SIZE: int = int(os.getenv("RESPONSE_CACHE_SIZE", "2048"))
+    RESPONSE_CACHE_TTL: float = float(os.getenv("RESPONSE_CACHE_TTL", "300"))
+    RESPONSE_CACHE_URL: str = os.getenv("RESPONSE_CACHE_URL", "")
+    SEARCH_LOG_QUEUE_SIZE: int = int(os.getenv("SEARCH_LOG_QUEUE_SIZE", "10000"))
+    SEARCH_LOG_BATCH_SIZE: int = int(os.getenv("SEARCH_LOG_BATCH_SIZE", "500"))
+    SEARCH_LOG_FLUSH_INTERVAL: float = float(os.getenv("SEARCH_LOG_FLUSH_INTERVAL", "1"))
+    SEARCH_LOG_BLOCK_MS: float = float(os.getenv("SEARCH_LOG_BLOCK_MS", "0"))
+    METADATA_STORE_ENABLED: bool = os.getenv("METADATA_STORE_ENABLED", "true").lower() == "true"
+    WARMUP_ON_STARTUP: bool = os.getenv("WARMUP_ON_STARTUP", "true").lower() == "true"
+    API_WORKER_THREADS: int = int(os.getenv("API_WORKER_THREADS", "8"))
+    API_MAX_QUEUED: int = int(os.getenv("API_MAX_QUEUED", "32"))
+    SEARCH_BATCH_MAX_QUERIES: int = int(os.getenv("SEARCH_BATCH_MAX_QUERIES", "100"))
+    EXPORT_MAX_RESULTS: int = int(os.getenv("EXPORT_MAX_RESULTS", "10000"))
+    EXPORT_CHUNK_SIZE: int = int(os.getenv("EXPORT_CHUNK_SIZE", "200"))
+    EXPORT_CURSOR_CACHE_SIZE: int = int(os.getenv("EXPORT_CURSOR_CACHE_SIZE", "256"))
+    EXPORT_CURSOR_TTL: float = float(os.getenv("EXPORT_CURSOR_TTL", "900"))
     API_TITLE: str = "ScholarScope API"
     API_VERSION: str = "1.0.0"
     API_DESCRIPTION: str = "Retrieval-Augmented Research Copilot"
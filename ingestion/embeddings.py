@@ -1,27 +1,160 @@
-from sentence_transformers import SentenceTransformer
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-from typing import List, Union
+from tqdm import tqdm
+from pathlib import Path
+from typing import Callable, List, Optional, Union
 from app.config import get_settings
+from ingestion.embedding_cache import EmbeddingCache, QueryEmbeddingCache
 
 settings = get_settings()
 
+# torch runs the PyTorch model; onnx exports it once to EMBEDDING_ONNX_DIR and runs it
+# through ONNX Runtime; onnx-int8 additionally applies dynamic int8 weight quantization
+# for the CPU instruction set named by EMBEDDING_ONNX_QUANTIZATION.
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx-int8")
+
+# texts per task handed to a pool worker; lists no longer than this stay in-process
+WORKER_CHUNK_SIZE = 512
+
+# upper bound on texts per forward pass when a token budget is set, so a run of very
+# short titles does not turn into one enormous batch
+MAX_BATCH_SIZE = 256
+
+_worker_generator = None
+
+
+def _init_worker(model_name: str, backend: str, num_threads: int):
+    global _worker_generator
+    import torch
+    # split the cores between workers instead of every worker claiming all of them
+    torch.set_num_threads(num_threads)
+    _worker_generator = EmbeddingGenerator(model_name, cache_path="", backend=backend, num_workers=1)
+    _worker_generator.load_model()
+
+
+def _worker_encode(texts: List[str]) -> np.ndarray:
+    return _worker_generator._encode(texts)
+
+
+def _token_budget_batches(lengths: List[int], max_tokens: int, max_batch_size: int = MAX_BATCH_SIZE) -> List[np.ndarray]:
+    # Longest first, so each batch is padded to the length of its first text and
+    # grows until that padded size would exceed max_tokens.
+    order = np.argsort(-np.asarray(lengths), kind="stable")
+    batches = []
+    start = 0
+    while start < len(order):
+        longest = lengths[order[start]]
+        size = max(1, min(max_batch_size, max_tokens // max(longest, 1)))
+        batches.append(order[start:start + size])
+        start += size
+    return batches
+
 
 class EmbeddingGenerator:
-    def __init__(self, model_name: str = settings.EMBEDDING_MODEL):
+    def __init__(self, model_name: str = settings.EMBEDDING_MODEL, cache_path: str = settings.EMBEDDING_CACHE_PATH,
+                 backend: str = settings.EMBEDDING_BACKEND, num_workers: int = settings.EMBEDDING_WORKERS,
+                 batch_tokens: int = settings.EMBEDDING_BATCH_TOKENS):
+        if backend not in EMBEDDING_BACKENDS:
+            raise ValueError(f"Unknown embedding backend: {backend}")
+        self.model_name = model_name
+        self.backend = backend
+        self.num_workers = num_workers
+        self.batch_tokens = batch_tokens
+        self.model = None
+        self._pool = None
+        self._pool_workers = 0
+        self.cache_path = cache_path
+        self._cache = None
+        self.query_cache = QueryEmbeddingCache(settings.QUERY_CACHE_SIZE, settings.QUERY_CACHE_TTL)
+        self._model_change_hooks: List[Callable[[str], None]] = []
+        self.add_model_change_hook(lambda model_name: self.query_cache.clear())
+        self.add_model_change_hook(lambda model_name: self.close_pool())
+    
+    def add_model_change_hook(self, hook: Callable[[str], None]):
+        self._model_change_hooks.append(hook)
+    
+    def set_model(self, model_name: str):
+        if model_name == self.model_name:
+            return
         self.model_name = model_name
         self.model = None
+        # cached vectors from the previous model are not comparable with new ones
+        for hook in self._model_change_hooks:
+            hook(model_name)
+    
+    @property
+    def cache(self) -> Optional[EmbeddingCache]:
+        if self._cache is None and self.cache_path:
+            self._cache = EmbeddingCache(self.cache_path, max_entries=settings.EMBEDDING_CACHE_MAX_ENTRIES)
+        return self._cache
         
+    @property
+    def cache_namespace(self) -> str:
+        # quantized backends produce slightly different vectors, so they get their own keys
+        return self.model_name if self.backend == "torch" else f"{self.model_name}#{self.backend}"
+    
     def load_model(self):
         if self.model is None:
-            print(f"Loading embedding model: {self.model_name}")
-            self.model = SentenceTransformer(self.model_name)
+            print(f"Loading embedding model: {self.model_name} ({self.backend})")
+            if self.backend == "torch":
+                # imported here: sentence_transformers pulls in torch, which takes seconds
+                from sentence_transformers import SentenceTransformer
+                self.model = SentenceTransformer(self.model_name)
+            else:
+                self.model = self._load_onnx_model()
     
-    def generate(self, texts: Union[str, List[str]]) -> np.ndarray:
-        self.load_model()
+    def _load_onnx_model(self):
+        from sentence_transformers import SentenceTransformer
+        export_dir = Path(settings.EMBEDDING_ONNX_DIR) / self.model_name.replace("/", "__")
+        if not (export_dir / "onnx" / "model.onnx").exists():
+            print(f"Exporting {self.model_name} to ONNX: {export_dir}")
+            SentenceTransformer(self.model_name, backend="onnx").save_pretrained(str(export_dir))
+        
+        if self.backend == "onnx":
+            return SentenceTransformer(str(export_dir), backend="onnx")
         
+        quantization = settings.EMBEDDING_ONNX_QUANTIZATION
+        file_name = f"onnx/model_qint8_{quantization}.onnx"
+        if not (export_dir / file_name).exists():
+            from sentence_transformers import export_dynamic_quantized_onnx_model
+            print(f"Quantizing {self.model_name} to int8 ({quantization})")
+            export_dynamic_quantized_onnx_model(
+                SentenceTransformer(str(export_dir), backend="onnx"), quantization, str(export_dir)
+            )
+        return SentenceTransformer(str(export_dir), backend="onnx", model_kwargs={"file_name": file_name})
+    
+    def generate(self, texts: Union[str, List[str]], use_cache: bool = False) -> np.ndarray:
         if isinstance(texts, str):
             texts = [texts]
         
+        if use_cache and self.cache is not None:
+            return self._generate_cached(texts)
+        return self._encode(texts)
+    
+    def _generate_cached(self, texts: List[str]) -> np.ndarray:
+        keys = [EmbeddingCache.make_key(self.cache_namespace, text) for text in texts]
+        vectors = self.cache.get_many(keys)
+        
+        missing = {key: text for key, text in zip(keys, texts) if key not in vectors}
+        if missing:
+            encoded = self._encode(list(missing.values()))
+            self.cache.put_many(list(missing.keys()), encoded)
+            vectors.update(zip(missing.keys(), encoded))
+        
+        if not keys:
+            return np.empty((0, settings.EMBEDDING_DIM), dtype=np.float32)
+        return np.stack([vectors[key] for key in keys])
+    
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        if self.num_workers > 1 and len(texts) > WORKER_CHUNK_SIZE:
+            return self._encode_parallel(texts)
+        
+        self.load_model()
+        if self.batch_tokens > 0 and len(texts) > 1:
+            return self._encode_token_budget(texts)
+        
         embeddings = self.model.encode(
             texts,
             show_progress_bar=len(texts) > 100,
@@ -31,8 +164,66 @@ class EmbeddingGenerator:
         
         return embeddings
     
+    def _encode_token_budget(self, texts: List[str]) -> np.ndarray:
+        lengths = self.token_lengths(texts)
+        embeddings = None
+        for batch in tqdm(_token_budget_batches(lengths, self.batch_tokens), disable=len(texts) <= 100):
+            encoded = self.model.encode(
+                [texts[i] for i in batch],
+                batch_size=len(batch),
+                show_progress_bar=False,
+                convert_to_numpy=True
+            )
+            if embeddings is None:
+                embeddings = np.empty((len(texts), encoded.shape[1]), dtype=encoded.dtype)
+            # scatter back so rows follow the input order
+            embeddings[batch] = encoded
+        return embeddings
+    
+    def token_lengths(self, texts: List[str]) -> List[int]:
+        self.load_model()
+        tokenized = self.model.tokenizer(texts, truncation=True, max_length=self.model.max_seq_length)
+        return [len(ids) for ids in tokenized["input_ids"]]
+    
+    def _encode_parallel(self, texts: List[str]) -> np.ndarray:
+        if self._pool is None or self._pool_workers != self.num_workers:
+            self.close_pool()
+            print(f"Starting {self.num_workers} embedding workers")
+            num_threads = max(1, (os.cpu_count() or 1) // self.num_workers)
+            # spawn: forked children would inherit the parent's torch thread pools
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.num_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.model_name, self.backend, num_threads),
+            )
+            self._pool_workers = self.num_workers
+        
+        chunks = [texts[start:start + WORKER_CHUNK_SIZE] for start in range(0, len(texts), WORKER_CHUNK_SIZE)]
+        # map yields results in submission order, so rows line up with texts
+        return np.concatenate(list(self._pool.map(_worker_encode, chunks)))
+    
+    def close_pool(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+            self._pool_workers = 0
+    
     def generate_query_embedding(self, query: str) -> np.ndarray:
-        return self.generate(query)[0]
+        return self.generate_query_embeddings([query])[0]
+    
+    def generate_query_embeddings(self, queries: List[str]) -> np.ndarray:
+        queries = [QueryEmbeddingCache.normalize(query) for query in queries]
+        vectors = [self.query_cache.get(query) for query in queries]
+        
+        missing = list(dict.fromkeys(query for query, vector in zip(queries, vectors) if vector is None))
+        if missing:
+            encoded = dict(zip(missing, self.generate(missing)))
+            for query, vector in encoded.items():
+                self.query_cache.put(query, vector)
+            vectors = [encoded[query] if vector is None else vector for query, vector in zip(queries, vectors)]
+        
+        return np.stack(vectors)
 
 
 _embedding_generator = None
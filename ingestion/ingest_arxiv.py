@@ -1,12 +1,14 @@
 import arxiv
 import argparse
+import time
 from typing import List
 from sqlalchemy.orm import Session
 from tqdm import tqdm
 import numpy as np
 
 from app.models import Document, SessionLocal, create_tables
-from retrieval.faiss_index import get_faiss_index
+from retrieval.bm25 import BM25Index
+from retrieval.faiss_index import FAISSIndex, ShardedFAISSIndex, create_faiss_index, get_faiss_index
 from ingestion.embeddings import get_embedding_generator
 from app.config import get_settings
 
@@ -41,23 +43,57 @@ def fetch_arxiv_papers(category: str = "cs.AI", max_results: int = 100):
     return papers
 
 
-def ingest_papers(papers: List[dict], db: Session):
+def print_cache_stats(embedding_gen):
+    cache = embedding_gen.cache
+    if cache is not None:
+        print(f"✓ Embedding cache: {cache.hits} hits, {cache.misses} misses ({cache.hit_rate:.1%} hit rate)")
+
+
+def embed_texts(embedding_gen, texts: List[str]) -> np.ndarray:
+    print("Generating embeddings...")
+    start = time.perf_counter()
+    embeddings = embedding_gen.generate(texts, use_cache=True)
+    elapsed = time.perf_counter() - start
+    rate = len(texts) / elapsed if elapsed > 0 else float("inf")
+    print(f"✓ Embedded {len(texts)} texts in {elapsed:.1f}s ({rate:.1f} texts/sec, {embedding_gen.num_workers} workers)")
+    return embeddings
+
+
+def build_bm25_index(db: Session):
+    # the postings are immutable arrays, so every change rebuilds them from the database;
+    # call before saving FAISS so workers reloading the new version find the matching file
+    print("Building BM25 index...")
+    rows = db.query(Document.id, Document.arxiv_id, Document.title, Document.abstract, Document.authors).all()
+    texts = [f"{row.title} {row.abstract} {row.authors or ''} {row.arxiv_id}" for row in rows]
+    bm25_index = BM25Index.build([row.id for row in rows], texts)
+    bm25_index.save(BM25Index.path_for(settings.FAISS_INDEX_PATH))
+    print(f"✓ BM25 index: {bm25_index.num_docs} papers, {len(bm25_index.vocabulary)} terms")
+
+
+def ingest_papers(papers: List[dict], db: Session, update_existing: bool = False):
     print(f"\nIngesting {len(papers)} papers...")
     
+    if db.query(Document).filter(Document.embedding_id != Document.id).first():
+        raise RuntimeError("Index uses positional embedding ids; run with --rebuild once before ingesting")
+    
     faiss_index = get_faiss_index()
     embedding_gen = get_embedding_generator()
     
     texts = [f"{paper['title']}. {paper['abstract']}" for paper in papers]
     
-    print("Generating embeddings...")
-    all_embeddings = embedding_gen.generate(texts)
+    all_embeddings = embed_texts(embedding_gen, texts)
     
     print("Storing in database and FAISS index...")
     new_docs = []
+    updated_docs = []
     
     for i, (paper, embedding) in enumerate(tqdm(zip(papers, all_embeddings), total=len(papers))):
         existing = db.query(Document).filter(Document.arxiv_id == paper["arxiv_id"]).first()
         if existing:
+            if update_existing and (existing.title, existing.abstract) != (paper["title"], paper["abstract"]):
+                for field in ("title", "authors", "abstract", "categories", "published_date", "pdf_url"):
+                    setattr(existing, field, paper[field])
+                updated_docs.append((existing, embedding))
             continue
         
         doc = Document(
@@ -67,23 +103,99 @@ def ingest_papers(papers: List[dict], db: Session):
             abstract=paper["abstract"],
             categories=paper["categories"],
             published_date=paper["published_date"],
-            pdf_url=paper["pdf_url"],
-            embedding_id=faiss_index.size + len(new_docs)
+            pdf_url=paper["pdf_url"]
         )
         db.add(doc)
         new_docs.append((doc, embedding))
     
+    # vectors are keyed on the primary key, so new rows need their ids first
+    db.flush()
+    for doc, _ in new_docs:
+        doc.embedding_id = doc.id
     db.commit()
     
     if new_docs:
         embeddings_array = np.array([emb for _, emb in new_docs])
-        doc_ids = [doc.embedding_id for doc, _ in new_docs]
-        faiss_index.add_embeddings(embeddings_array, doc_ids)
-        
+        faiss_index.add_embeddings(embeddings_array, [doc.embedding_id for doc, _ in new_docs])
+    
+    if updated_docs:
+        embeddings_array = np.array([emb for _, emb in updated_docs])
+        faiss_index.replace(embeddings_array, [doc.embedding_id for doc, _ in updated_docs])
+    
+    if new_docs or updated_docs:
+        build_bm25_index(db)
         print("Saving FAISS index...")
         faiss_index.save(settings.FAISS_INDEX_PATH)
     
     print(f"✓ Successfully ingested {len(new_docs)} new papers")
+    print_cache_stats(embedding_gen)
+    if update_existing:
+        print(f"✓ Re-embedded {len(updated_docs)} changed papers")
+    print(f"✓ Total documents in index: {faiss_index.size}")
+
+
+def retract_papers(arxiv_ids: List[str], db: Session):
+    print(f"\nRetracting {len(arxiv_ids)} papers...")
+    
+    faiss_index = get_faiss_index()
+    documents = db.query(Document).filter(Document.arxiv_id.in_(arxiv_ids)).all()
+    
+    removed = faiss_index.remove([doc.embedding_id for doc in documents if doc.embedding_id is not None])
+    for doc in documents:
+        db.delete(doc)
+    db.commit()
+    
+    if documents:
+        build_bm25_index(db)
+    if removed:
+        print("Saving FAISS index...")
+        faiss_index.save(settings.FAISS_INDEX_PATH)
+    
+    print(f"✓ Removed {len(documents)} papers ({removed} vectors)")
+    print(f"✓ Total documents in index: {faiss_index.size}")
+
+
+def rebuild_index(db: Session, index_type: str = settings.FAISS_INDEX_TYPE, shard: int = None):
+    query = db.query(Document)
+    if shard is not None:
+        num_shards = settings.FAISS_NUM_SHARDS
+        if not 0 <= shard < num_shards:
+            raise ValueError(f"Shard must be between 0 and {num_shards - 1}")
+        query = query.filter(Document.id % num_shards == shard)
+    documents = query.order_by(Document.id).all()
+    target = f"shard {shard}" if shard is not None else "index"
+    print(f"\nRebuilding {index_type} {target} over {len(documents)} papers...")
+    
+    if not documents:
+        print("No papers in database. Nothing to rebuild.")
+        return
+    
+    embedding_gen = get_embedding_generator()
+    texts = [f"{doc.title}. {doc.abstract}" for doc in documents]
+    
+    all_embeddings = embed_texts(embedding_gen, texts)
+    
+    if shard is not None:
+        faiss_index = FAISSIndex(index_type=index_type)
+        path = ShardedFAISSIndex.shard_path(settings.FAISS_INDEX_PATH, shard)
+    else:
+        faiss_index = create_faiss_index(index_type=index_type)
+        path = settings.FAISS_INDEX_PATH
+    print("Training index...")
+    faiss_index.train(all_embeddings)
+    faiss_index.add_embeddings(all_embeddings, [doc.id for doc in documents])
+    
+    if shard is None:
+        build_bm25_index(db)
+    print("Saving FAISS index...")
+    faiss_index.save(path)
+    print_cache_stats(embedding_gen)
+    
+    # papers ingested before stable ids used their index position as embedding_id
+    for doc in documents:
+        doc.embedding_id = doc.id
+    db.commit()
+    
     print(f"✓ Total documents in index: {faiss_index.size}")
 
 
@@ -91,11 +203,34 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--category", type=str, default="cs.AI")
     parser.add_argument("--max-papers", type=int, default=100)
+    parser.add_argument("--rebuild", action="store_true", help="Re-embed all stored papers into a fresh index")
+    parser.add_argument("--index-type", type=str, default=settings.FAISS_INDEX_TYPE, help="Index type used by --rebuild")
+    parser.add_argument("--shard", type=int, default=None, help="With --rebuild, rebuild only this shard")
+    parser.add_argument("--update", action="store_true", help="Re-embed fetched papers whose title or abstract changed")
+    parser.add_argument("--retract", type=str, nargs="+", metavar="ARXIV_ID", help="Remove papers from the database and index")
+    parser.add_argument("--workers", type=int, default=settings.EMBEDDING_WORKERS, help="Embedding worker processes")
     
     args = parser.parse_args()
     
     print("Initializing database...")
     create_tables()
+    get_embedding_generator().num_workers = args.workers
+    
+    if args.rebuild:
+        db = SessionLocal()
+        try:
+            rebuild_index(db, index_type=args.index_type, shard=args.shard)
+        finally:
+            db.close()
+        return
+    
+    if args.retract:
+        db = SessionLocal()
+        try:
+            retract_papers(args.retract, db)
+        finally:
+            db.close()
+        return
     
     papers = fetch_arxiv_papers(category=args.category, max_results=args.max_papers)
     
@@ -105,7 +240,7 @@ def main():
     
     db = SessionLocal()
     try:
-        ingest_papers(papers, db)
+        ingest_papers(papers, db, update_existing=args.update)
     finally:
         db.close()
     
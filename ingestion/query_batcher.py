@@ -0,0 +1,98 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Dict, List
+import numpy as np
+
+
+class QueryBatcher:
+    # Coalesces query embeddings from concurrent requests: the first query to arrive
+    # opens a window of window_ms, everything queued before it closes (up to
+    # max_batch_size queries) is encoded in one forward pass, and each caller gets
+    # back its own rows. A zero window encodes every call directly.
+
+    def __init__(self, embedding_generator, window_ms: float = 2.0, max_batch_size: int = 64):
+        self.embedding_generator = embedding_generator
+        self.window_ms = window_ms
+        self.max_batch_size = max_batch_size
+        self.batches = 0
+        self.queries = 0
+        self.max_batch_seen = 0
+        self._batch_sizes = deque(maxlen=1024)
+        self._queue_delays = deque(maxlen=1024)
+        self._queue = queue.Queue()
+        self._worker = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+    def encode(self, queries: List[str]) -> np.ndarray:
+        if self.window_ms <= 0:
+            return self.embedding_generator.generate_query_embeddings(queries)
+
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((queries, future, time.perf_counter()))
+        return future.result()
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._start_lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name="query-batcher", daemon=True)
+                    self._worker.start()
+
+    def _run(self):
+        while True:
+            pending = [self._queue.get()]
+            size = len(pending[0][0])
+            deadline = time.perf_counter() + self.window_ms / 1000
+            while size < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                pending.append(item)
+                size += len(item[0])
+            self._encode_batch(pending)
+
+    def _encode_batch(self, pending):
+        started = time.perf_counter()
+        queries = [query for item_queries, _, _ in pending for query in item_queries]
+        try:
+            vectors = self.embedding_generator.generate_query_embeddings(queries)
+        except Exception as exc:
+            for _, future, _ in pending:
+                future.set_exception(exc)
+            return
+
+        with self._stats_lock:
+            self.batches += 1
+            self.queries += len(queries)
+            self.max_batch_seen = max(self.max_batch_seen, len(queries))
+            self._batch_sizes.append(len(queries))
+            self._queue_delays.extend((started - enqueued) * 1000 for _, _, enqueued in pending)
+
+        offset = 0
+        for item_queries, future, _ in pending:
+            future.set_result(vectors[offset:offset + len(item_queries)])
+            offset += len(item_queries)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            delays = np.array(self._queue_delays) if self._queue_delays else np.zeros(1)
+            return {
+                "window_ms": self.window_ms,
+                "max_batch_size": self.max_batch_size,
+                "batches": self.batches,
+                "queries": self.queries,
+                "mean_batch_size": float(np.mean(self._batch_sizes)) if self._batch_sizes else 0.0,
+                "max_batch_seen": self.max_batch_seen,
+                # over the most recent 1024 requests
+                "queue_delay_ms_p50": float(np.percentile(delays, 50)),
+                "queue_delay_ms_p99": float(np.percentile(delays, 99)),
+            }
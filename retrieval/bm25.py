@@ -0,0 +1,117 @@
+import os
+import re
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from app.config import get_settings
+from retrieval.filters import DocumentFilter
+
+settings = get_settings()
+
+# words, numbers and dotted identifiers such as arXiv ids ("2401.01234v2" -> "2401.01234", "v2")
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    # Okapi BM25 over Document.id in CSR layout: the postings of term t are
+    # doc_ids[offsets[t]:offsets[t + 1]] with matching term frequencies in tfs.
+    # The arrays are immutable; ingestion rebuilds and replaces the whole file.
+
+    def __init__(self, terms: List[str], offsets: np.ndarray, doc_ids: np.ndarray, tfs: np.ndarray,
+                 doc_lengths: np.ndarray, k1: float = settings.BM25_K1, b: float = settings.BM25_B):
+        self.vocabulary: Dict[str, int] = {term: i for i, term in enumerate(terms)}
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        self.version = 0
+
+        self.num_docs = int((doc_lengths > 0).sum())
+        avgdl = doc_lengths[doc_lengths > 0].mean() if self.num_docs else 1.0
+        df = np.diff(offsets)
+        self.idf = np.log1p((self.num_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        # per-document length normalisation, precomputed once
+        self.norms = (k1 * (1 - b + b * doc_lengths / avgdl)).astype(np.float32)
+
+    @classmethod
+    def build(cls, doc_ids: Sequence[int], texts: Sequence[str]) -> "BM25Index":
+        vocabulary: Dict[str, int] = {}
+        postings = defaultdict(list)
+        num_ids = max(doc_ids) + 1 if len(doc_ids) else 0
+        doc_lengths = np.zeros(num_ids, dtype=np.int32)
+
+        for doc_id, text in zip(doc_ids, texts):
+            tokens = tokenize(text)
+            doc_lengths[doc_id] = len(tokens)
+            counts = defaultdict(int)
+            for token in tokens:
+                counts[token] += 1
+            for token, tf in counts.items():
+                term_id = vocabulary.setdefault(token, len(vocabulary))
+                postings[term_id].append((doc_id, tf))
+
+        terms = list(vocabulary)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(postings[term_id]) for term_id in range(len(terms))])
+        flat = [posting for term_id in range(len(terms)) for posting in postings[term_id]]
+        posting_ids = np.array([doc_id for doc_id, _ in flat], dtype=np.int32)
+        tfs = np.array([min(tf, 65535) for _, tf in flat], dtype=np.uint16)
+        return cls(terms, offsets, posting_ids, tfs, doc_lengths)
+
+    @staticmethod
+    def path_for(index_path: str) -> str:
+        return f"{index_path}.bm25.npz"
+
+    def save(self, path: str):
+        # the vocabulary is stored as one newline-separated utf-8 blob; tokens never contain newlines
+        terms = "\n".join(self.vocabulary).encode("utf-8")
+        tmp = f"{path}.tmp.npz"
+        np.savez(tmp, terms=np.frombuffer(terms, dtype=np.uint8), offsets=self.offsets,
+                 doc_ids=self.doc_ids, tfs=self.tfs, doc_lengths=self.doc_lengths)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with np.load(path) as data:
+            blob = data["terms"].tobytes().decode("utf-8")
+            terms = blob.split("\n") if blob else []
+            return cls(terms, data["offsets"], data["doc_ids"], data["tfs"], data["doc_lengths"])
+
+    def search(self, query: str, top_k: int = 5,
+               id_filter: Optional[DocumentFilter] = None) -> Tuple[List[int], List[float]]:
+        term_ids = {self.vocabulary[token] for token in tokenize(query) if token in self.vocabulary}
+        if not term_ids:
+            return [], []
+
+        scores = np.zeros(len(self.doc_lengths), dtype=np.float32)
+        for term_id in term_ids:
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            ids = self.doc_ids[start:end]
+            tfs = self.tfs[start:end].astype(np.float32)
+            # a document appears at most once per posting list, so fancy-index += is safe
+            scores[ids] += self.idf[term_id] * tfs * (self.k1 + 1) / (tfs + self.norms[ids])
+
+        candidates = np.flatnonzero(scores > 0)
+        if id_filter is not None:
+            candidates = candidates[id_filter.contains(candidates)]
+        if len(candidates) > top_k:
+            candidates = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return candidates.tolist(), scores[candidates].tolist()
+
+
+def reciprocal_rank_fusion(ranked_lists: List[List[int]], top_k: int,
+                           k: int = settings.RRF_K) -> Tuple[List[int], List[float]]:
+    # score(d) = sum over lists of 1 / (k + rank of d), ranks starting at 1
+    fused = defaultdict(float)
+    for ranked in ranked_lists:
+        for rank, doc_id in enumerate(ranked, start=1):
+            fused[doc_id] += 1.0 / (k + rank)
+    best = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:top_k]
+    return [doc_id for doc_id, _ in best], [score for _, score in best]
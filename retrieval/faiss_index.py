@@ -1,75 +1,638 @@
 import faiss
 import numpy as np
 import pickle
+import glob
+import json
+import functools
 import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 from app.config import get_settings
+from retrieval.filters import DocumentFilter
+from retrieval.locks import ReadWriteLock
 
 settings = get_settings()
 
+# Supported index types and their recall/latency trade-off:
+#   flat - exact brute-force inner product. Perfect recall, but every query scans
+#          the whole corpus, so latency grows linearly with the number of papers.
+#   ivf  - k-means partitions the corpus into FAISS_NLIST cells and a query scans
+#          only the FAISS_NPROBE closest ones. Roughly nprobe/nlist of the flat cost;
+#          recall drops when relevant papers fall in unvisited cells. Needs training.
+#   hnsw - graph search with FAISS_HNSW_M links per vector. Near-exact recall at
+#          logarithmic latency, tuned by FAISS_EF_SEARCH, at the price of extra
+#          memory for the graph and slower builds.
+#   sq8  - flat scan over 8-bit scalar-quantized codes: 1 byte per dimension
+#          instead of 4, with a small loss in score precision.
+#   fp16 - flat scan over half-precision codes: 2 bytes per dimension, practically
+#          lossless for normalized embeddings.
+#   pq   - product quantization into FAISS_PQ_M sub-vectors of FAISS_PQ_NBITS each
+#          (48 bytes per vector by default). Largest savings, lowest raw recall.
+# Compressed types can re-rank the top FAISS_RERANK_FACTOR * top_k candidates
+# against exact float32 vectors that stay on disk and are read through mmap.
+INDEX_TYPES = ("flat", "ivf", "hnsw", "sq8", "fp16", "pq")
+COMPRESSED_TYPES = ("sq8", "fp16", "pq")
+
+
+def _locked(mode: str):
+    # searches share the index; appends, removals and loads take it exclusively.
+    # The writer may re-enter, so write paths can call each other.
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with getattr(self._lock, mode)():
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
 
 class FAISSIndex:
-    def __init__(self, dimension: int = settings.EMBEDDING_DIM):
+    def __init__(self, dimension: int = settings.EMBEDDING_DIM, index_type: str = settings.FAISS_INDEX_TYPE,
+                 rerank: bool = settings.FAISS_RERANK):
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown FAISS index type: {index_type}")
         self.dimension = dimension
+        self.index_type = index_type
+        self.rerank = rerank
         self.index = None
-        self.id_map = []
-        
-    def create_index(self):
-        self.index = faiss.IndexFlatIP(self.dimension)
-        
-    def add_embeddings(self, embeddings: np.ndarray, doc_ids: List[int]):
+        self.vectors = None
+        self.mmapped = False
+        self.version = 0
+        self._lock = ReadWriteLock()
+
+    @property
+    def reranking(self) -> bool:
+        return self.rerank and self.index_type in COMPRESSED_TYPES
+
+    @_locked("write")
+    def create_index(self, nlist: int = settings.FAISS_NLIST, pq_nbits: int = settings.FAISS_PQ_NBITS):
+        # vectors are keyed by Document.id: IVF stores ids in its inverted lists,
+        # every other type is wrapped in an IndexIDMap
+        if self.index_type == "ivf":
+            quantizer = faiss.IndexFlatIP(self.dimension)
+            self.index = faiss.IndexIVFFlat(quantizer, self.dimension, nlist, faiss.METRIC_INNER_PRODUCT)
+            return
+
+        if self.index_type == "hnsw":
+            base = faiss.IndexHNSWFlat(self.dimension, settings.FAISS_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+            base.hnsw.efConstruction = settings.FAISS_HNSW_EF_CONSTRUCTION
+        elif self.index_type == "sq8":
+            base = faiss.IndexScalarQuantizer(self.dimension, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+        elif self.index_type == "fp16":
+            base = faiss.IndexScalarQuantizer(self.dimension, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT)
+        elif self.index_type == "pq":
+            base = faiss.IndexPQ(self.dimension, settings.FAISS_PQ_M, pq_nbits, faiss.METRIC_INNER_PRODUCT)
+        else:
+            base = faiss.IndexFlatIP(self.dimension)
+        self.index = faiss.IndexIDMap(base)
+
+    def _base_index(self):
+        index = faiss.downcast_index(self.index)
+        return faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+
+    @_locked("write")
+    def train(self, embeddings: np.ndarray):
         if self.index is None:
             self.create_index()
-        
+        if self.index.is_trained:
+            return
+
+        embeddings = np.ascontiguousarray(embeddings, dtype='float32')
         faiss.normalize_L2(embeddings)
-        self.index.add(embeddings.astype('float32'))
-        self.id_map.extend(doc_ids)
-        
-    def search(self, query_embedding: np.ndarray, top_k: int = 5) -> Tuple[List[int], List[float]]:
-        if self.index is None or self.index.ntotal == 0:
-            return [], []
-        
-        query_embedding = query_embedding.reshape(1, -1).astype('float32')
-        faiss.normalize_L2(query_embedding)
-        
-        distances, indices = self.index.search(query_embedding, min(top_k, self.index.ntotal))
-        
-        doc_ids = [self.id_map[idx] for idx in indices[0] if idx < len(self.id_map)]
-        scores = distances[0].tolist()
-        
-        return doc_ids, scores
+
+        # k-means needs at least one training point per centroid; small corpora get fewer
+        if self.index_type == "ivf" and len(embeddings) < self.index.nlist:
+            self.create_index(nlist=max(1, len(embeddings)))
+        elif self.index_type == "pq" and len(embeddings) < 2 ** self._base_index().pq.nbits:
+            self.create_index(pq_nbits=max(1, int(np.log2(len(embeddings)))))
+        self.index.train(embeddings)
+
+    def _ensure_writable(self):
+        # mmapped code arrays are read-only views; FAISS aborts if asked to grow them
+        if not self.mmapped:
+            return
+        self.index = faiss.deserialize_index(faiss.serialize_index(self.index))
+        if self.vectors is not None:
+            self.vectors = np.array(self.vectors)
+        self.mmapped = False
+
+    def add_embeddings(self, embeddings: np.ndarray, doc_ids: List[int]):
+        # copy and normalise before taking the lock so searches are only blocked
+        # for the append itself, not for preparing the batch
+        embeddings = np.array(embeddings, dtype='float32', order='C')
+        faiss.normalize_L2(embeddings)
+        self._append(embeddings, np.asarray(doc_ids, dtype=np.int64))
+
+    @_locked("write")
+    def _append(self, embeddings: np.ndarray, doc_ids: np.ndarray):
+        if self.index is None:
+            self.create_index()
+        self._ensure_writable()
+
+        if not self.index.is_trained:
+            self.train(embeddings)
+
+        self.index.add_with_ids(embeddings, doc_ids)
+
+        if self.reranking:
+            self._store_vectors(embeddings, doc_ids)
+
+    @_locked("write")
+    def remove(self, doc_ids: List[int]) -> int:
+        if self.index is None or len(doc_ids) == 0:
+            return 0
+        self._ensure_writable()
+
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        if self.index_type == "hnsw":
+            return self._rebuild_hnsw_without(doc_ids)
+        return int(self.index.remove_ids(faiss.IDSelectorBatch(doc_ids)))
+
+    @_locked("write")
+    def replace(self, embeddings: np.ndarray, doc_ids: List[int]):
+        self.remove(doc_ids)
+        self.add_embeddings(embeddings, doc_ids)
+
+    def _rebuild_hnsw_without(self, doc_ids: np.ndarray) -> int:
+        # HNSW graphs cannot unlink nodes, so the surviving vectors are re-inserted
+        ids = self.id_map
+        keep = ~np.isin(ids, doc_ids)
+        if keep.all():
+            return 0
+        vectors = self._base_index().reconstruct_n(0, len(ids))[keep]
+        self.create_index()
+        if len(vectors):
+            self.index.add_with_ids(vectors, ids[keep])
+        return int((~keep).sum())
+
+    def _store_vectors(self, embeddings: np.ndarray, doc_ids: np.ndarray):
+        # exact vectors for re-ranking live in a dense array where row i is Document.id i
+        rows = int(doc_ids.max()) + 1
+        if self.vectors is None or len(self.vectors) < rows:
+            grown = np.zeros((rows, self.dimension), dtype='float32')
+            if self.vectors is not None:
+                grown[:len(self.vectors)] = self.vectors
+            self.vectors = grown
+        self.vectors[doc_ids] = embeddings
+
+    @property
+    @_locked("read")
+    def id_map(self) -> np.ndarray:
+        if self.index is None:
+            return np.empty(0, dtype=np.int64)
+        ivf = faiss.try_extract_index_ivf(self.index)
+        if ivf is None:
+            return faiss.vector_to_array(faiss.downcast_index(self.index).id_map)
+        invlists = ivf.invlists
+        ids = [
+            faiss.rev_swig_ptr(invlists.get_ids(list_no), invlists.list_size(list_no)).copy()
+            for list_no in range(ivf.nlist) if invlists.list_size(list_no)
+        ]
+        return np.concatenate(ids) if ids else np.empty(0, dtype=np.int64)
+
+    def _search_params(self, top_k: int, selector=None, exhaustive: bool = False):
+        kwargs = {} if selector is None else {"sel": selector}
+        if self.index_type == "ivf":
+            nprobe = faiss.try_extract_index_ivf(self.index).nlist if exhaustive else settings.FAISS_NPROBE
+            return faiss.SearchParametersIVF(nprobe=nprobe, **kwargs)
+        if self.index_type == "hnsw":
+            ef_search = self.index.ntotal if exhaustive else settings.FAISS_EF_SEARCH
+            return faiss.SearchParametersHNSW(efSearch=max(ef_search, top_k), **kwargs)
+        return faiss.SearchParameters(**kwargs) if kwargs else None
+
+    def search(self, query_embedding: np.ndarray, top_k: int = 5,
+               id_filter: Optional[DocumentFilter] = None) -> Tuple[List[int], List[float]]:
+        doc_ids, scores = self.search_batch(query_embedding.reshape(1, -1), top_k, id_filter=id_filter)
+        return doc_ids[0], scores[0]
+
+    @_locked("read")
+    def search_batch(self, query_embeddings: np.ndarray, top_k: int = 5, id_filter: Optional[DocumentFilter] = None,
+                     matches: Optional[int] = None) -> Tuple[List[List[int]], List[List[float]]]:
+        # matches: how many of the filter's ids this index can hold; a shard only
+        # holds its own residue class, so the filter-wide count would overstate it
+        _limit_omp_threads()
+        n = len(query_embeddings)
+        if id_filter is not None and matches is None:
+            matches = id_filter.count
+        if self.index is None or self.index.ntotal == 0 or (id_filter is not None and matches == 0):
+            return [[] for _ in range(n)], [[] for _ in range(n)]
+
+        query_embeddings = np.array(query_embeddings, dtype='float32', order='C').reshape(n, -1)
+        faiss.normalize_L2(query_embeddings)
+
+        rerank = self.reranking and self.vectors is not None
+        k = min(top_k * settings.FAISS_RERANK_FACTOR if rerank else top_k, self.index.ntotal)
+        # the selector is evaluated inside the FAISS scan, so filtered papers never
+        # take up result slots; it must stay referenced until the searches return
+        selector = id_filter.selector() if id_filter is not None and self.index_type != "pq" else None
+        if id_filter is not None and selector is None:
+            distances, labels = self._post_filtered_search(query_embeddings, k, id_filter, matches)
+        else:
+            distances, labels = self.index.search(query_embeddings, k, params=self._search_params(k, selector))
+
+        if selector is not None and self.index_type in ("ivf", "hnsw"):
+            # selective filters can starve an approximate search; retry those rows exhaustively
+            expected = min(k, matches)
+            short = np.flatnonzero((labels >= 0).sum(axis=1) < expected)
+            if len(short):
+                params = self._search_params(k, selector, exhaustive=True)
+                distances[short], labels[short] = self.index.search(query_embeddings[short], k, params=params)
+
+        all_ids, all_scores = [], []
+        for query_embedding, row_labels, row_distances in zip(query_embeddings, labels, distances):
+            # approximate indexes pad with -1 when fewer than k neighbours are reachable
+            valid = row_labels >= 0
+            doc_ids, scores = row_labels[valid], row_distances[valid]
+            if rerank:
+                doc_ids, scores = self._rerank(query_embedding, doc_ids, top_k)
+            all_ids.append(doc_ids.tolist())
+            all_scores.append(scores.tolist())
+
+        return all_ids, all_scores
+
+    def _post_filtered_search(self, query_embeddings: np.ndarray, k: int, id_filter: DocumentFilter, matches: int):
+        # IndexPQ rejects search params, so the selector cannot run inside the scan.
+        # Over-fetch by the filter's selectivity, drop non-matching labels, and
+        # double the fetch for rows still short of k until the whole index is seen.
+        ntotal = self.index.ntotal
+        expected = min(k, matches)
+        distances = np.full((len(query_embeddings), k), -np.inf, dtype='float32')
+        labels = np.full((len(query_embeddings), k), -1, dtype=np.int64)
+        fetch = min(ntotal, max(k, -(-k * ntotal // max(matches, 1))))
+        pending = np.arange(len(query_embeddings))
+        while len(pending):
+            row_distances, row_labels = self.index.search(query_embeddings[pending], fetch)
+            short = []
+            for row, found_labels, found_distances in zip(pending, row_labels, row_distances):
+                keep = np.flatnonzero((found_labels >= 0) & id_filter.contains(found_labels))[:k]
+                labels[row, :len(keep)] = found_labels[keep]
+                distances[row, :len(keep)] = found_distances[keep]
+                if len(keep) < expected:
+                    short.append(row)
+            if fetch >= ntotal:
+                break
+            pending = np.asarray(short, dtype=np.int64)
+            fetch = min(ntotal, fetch * 2)
+        return distances, labels
     
+    def _rerank(self, query_embedding: np.ndarray, doc_ids: np.ndarray, top_k: int):
+        doc_ids = np.sort(doc_ids[doc_ids < len(self.vectors)])
+        exact = np.asarray(self.vectors[doc_ids]) @ query_embedding
+        best = np.argsort(-exact)[:top_k]
+        return doc_ids[best], exact[best]
+
+    @_locked("read")
     def save(self, path: str):
         Path(path).parent.mkdir(parents=True, exist_ok=True)
-        faiss.write_index(self.index, f"{path}.index")
-        
-        with open(f"{path}.map", "wb") as f:
-            pickle.dump(self.id_map, f)
-    
-    def load(self, path: str):
-        if not os.path.exists(f"{path}.index"):
-            raise FileNotFoundError(f"Index file not found: {path}.index")
-        
-        self.index = faiss.read_index(f"{path}.index")
-        
-        with open(f"{path}.map", "rb") as f:
-            self.id_map = pickle.load(f)
-    
+
+        # every save is a new immutable snapshot <path>.v<N>.*; the <path>.version
+        # pointer is renamed into place last, so readers never see a partial write
+        # and files still mmapped by running workers are never modified
+        version = max(read_index_version(path), self.version) + 1
+        snapshot = f"{path}.v{version}"
+        faiss.write_index(self.index, f"{snapshot}.index")
+
+        if self.reranking and self.vectors is not None:
+            np.save(f"{snapshot}.vectors.npy", np.asarray(self.vectors))
+
+        with open(f"{path}.version.tmp", "w") as f:
+            json.dump({"version": version, "index_type": self.index_type, "created_at": time.time()}, f)
+        os.replace(f"{path}.version.tmp", f"{path}.version")
+        self.version = version
+
+        _prune_snapshots(path, keep_from=version - settings.FAISS_KEEP_SNAPSHOTS + 1)
+
+    @_locked("write")
+    def load(self, path: str, mmap: bool = settings.FAISS_MMAP):
+        version = read_index_version(path)
+        # indexes saved before versioned snapshots live directly at <path>.index
+        snapshot = f"{path}.v{version}" if version else path
+        if not os.path.exists(f"{snapshot}.index"):
+            raise FileNotFoundError(f"Index file not found: {snapshot}.index")
+
+        # with mmap the flat/SQ/PQ/HNSW code arrays are served straight from the page
+        # cache, so workers on one host share a single copy; IVF lists and the
+        # IndexIDMap ids are always read onto each worker's heap
+        flags = faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY if mmap else 0
+        self.index = faiss.read_index(f"{snapshot}.index", flags)
+        self.index_type = self._detect_index_type(self.index)
+        self.mmapped = mmap
+        self.version = version
+
+        if not self._is_id_mapped(self.index):
+            self._migrate_positional(path)
+
+        self.vectors = None
+        if self.reranking and os.path.exists(f"{snapshot}.vectors.npy"):
+            self.vectors = np.load(f"{snapshot}.vectors.npy", mmap_mode="r" if mmap else None)
+
+    @staticmethod
+    def _is_id_mapped(index) -> bool:
+        return faiss.try_extract_index_ivf(index) is not None or isinstance(faiss.downcast_index(index), faiss.IndexIDMap)
+
+    def _migrate_positional(self, path: str):
+        # older indexes kept a separate positional id map next to a bare index
+        if os.path.exists(f"{path}.ids.npy"):
+            ids = np.load(f"{path}.ids.npy")
+        else:
+            with open(f"{path}.map", "rb") as f:
+                ids = np.asarray(pickle.load(f), dtype=np.int64)
+
+        base = faiss.deserialize_index(faiss.serialize_index(self.index))
+        vectors = base.reconstruct_n(0, base.ntotal)
+        base.reset()
+        self.index = faiss.IndexIDMap(base)
+        self.index.add_with_ids(vectors, ids)
+        self.mmapped = False
+
+    @staticmethod
+    def _detect_index_type(index) -> str:
+        if faiss.try_extract_index_ivf(index) is not None:
+            return "ivf"
+        index = faiss.downcast_index(index)
+        if isinstance(index, faiss.IndexIDMap):
+            index = faiss.downcast_index(index.index)
+        if isinstance(index, faiss.IndexHNSW):
+            return "hnsw"
+        if isinstance(index, faiss.IndexScalarQuantizer):
+            return "sq8" if index.sq.qtype == faiss.ScalarQuantizer.QT_8bit else "fp16"
+        if isinstance(index, faiss.IndexPQ):
+            return "pq"
+        return "flat"
+
     @property
     def size(self) -> int:
         return self.index.ntotal if self.index else 0
 
+    @property
+    def bytes_per_vector(self) -> float:
+        if self.index is None:
+            return 0.0
+        ivf = faiss.try_extract_index_ivf(self.index)
+        if ivf is not None:
+            # inverted lists also keep the 8-byte id of every vector
+            return float(ivf.code_size + 8)
+        # the IndexIDMap wrapper keeps an 8-byte id per vector next to the codes
+        index = self._base_index()
+        if isinstance(index, faiss.IndexHNSW):
+            storage = faiss.downcast_index(index.storage)
+            links = index.hnsw.neighbors.size() * 4 / max(index.ntotal, 1)
+            return float(storage.code_size + links + 8)
+        return float(index.code_size + 8)
+
+
+_thread_state = threading.local()
+
+
+def _limit_omp_threads():
+    # the OpenMP thread count is per calling thread, so it is set once in every
+    # request/shard thread that searches rather than once at import
+    if settings.FAISS_OMP_THREADS > 0 and not getattr(_thread_state, "omp_limited", False):
+        faiss.omp_set_num_threads(settings.FAISS_OMP_THREADS)
+        _thread_state.omp_limited = True
+
+
+def read_index_version(path: str) -> int:
+    try:
+        with open(f"{path}.version") as f:
+            return int(json.load(f)["version"])
+    except FileNotFoundError:
+        return 0
+
+
+def _prune_snapshots(path: str, keep_from: int):
+    # workers that already opened an older snapshot keep their mapping after unlink
+    pattern = re.compile(re.escape(os.path.basename(path)) + r"\.v(\d+)\.")
+    for snapshot_file in glob.glob(f"{glob.escape(path)}.v*.*"):
+        match = pattern.match(os.path.basename(snapshot_file))
+        if match and int(match.group(1)) < keep_from:
+            os.remove(snapshot_file)
+
+
+class ShardedFAISSIndex:
+    # Papers are routed to shard Document.id % num_shards. Each shard is a complete
+    # FAISSIndex saved under <path>.shard<i>, so one shard can be rebuilt and swapped
+    # while the others keep serving; queries fan out to all shards in parallel.
+
+    def __init__(self, num_shards: int = settings.FAISS_NUM_SHARDS, dimension: int = settings.EMBEDDING_DIM,
+                 index_type: str = settings.FAISS_INDEX_TYPE, rerank: bool = settings.FAISS_RERANK):
+        if num_shards < 1:
+            raise ValueError("num_shards must be at least 1")
+        self.num_shards = num_shards
+        self.dimension = dimension
+        self.shards = [FAISSIndex(dimension, index_type, rerank) for _ in range(num_shards)]
+        self._executor = ThreadPoolExecutor(max_workers=num_shards, thread_name_prefix="faiss-shard")
+        self._residues = {}
+
+    @property
+    def index_type(self) -> str:
+        return self.shards[0].index_type
+
+    @property
+    def reranking(self) -> bool:
+        return self.shards[0].reranking
+
+    def shard_for(self, doc_id: int) -> int:
+        return int(doc_id) % self.num_shards
+
+    def _partition(self, doc_ids: List[int]) -> List[np.ndarray]:
+        shard_nos = np.asarray(doc_ids, dtype=np.int64) % self.num_shards
+        return [np.flatnonzero(shard_nos == shard_no) for shard_no in range(self.num_shards)]
+
+    def create_index(self):
+        for shard in self.shards:
+            shard.create_index()
+
+    def train(self, embeddings: np.ndarray):
+        for shard in self.shards:
+            shard.train(embeddings.copy())
+
+    def add_embeddings(self, embeddings: np.ndarray, doc_ids: List[int]):
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        for shard, rows in zip(self.shards, self._partition(doc_ids)):
+            if len(rows):
+                shard.add_embeddings(embeddings[rows], doc_ids[rows])
+
+    def remove(self, doc_ids: List[int]) -> int:
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        return sum(
+            shard.remove(doc_ids[rows])
+            for shard, rows in zip(self.shards, self._partition(doc_ids)) if len(rows)
+        )
+
+    def replace(self, embeddings: np.ndarray, doc_ids: List[int]):
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        for shard, rows in zip(self.shards, self._partition(doc_ids)):
+            if len(rows):
+                shard.replace(embeddings[rows], doc_ids[rows])
+
+    def search(self, query_embedding: np.ndarray, top_k: int = 5,
+               id_filter: Optional[DocumentFilter] = None) -> Tuple[List[int], List[float]]:
+        doc_ids, scores = self.search_batch(query_embedding.reshape(1, -1), top_k, id_filter=id_filter)
+        return doc_ids[0], scores[0]
+
+    def search_batch(self, query_embeddings: np.ndarray, top_k: int = 5,
+                     id_filter: Optional[DocumentFilter] = None) -> Tuple[List[List[int]], List[List[float]]]:
+        shards = list(self.shards)
+        matches = [
+            id_filter.count_within(self._residue_bitmap(shard_no, len(id_filter.bitmap))) if id_filter is not None else None
+            for shard_no in range(self.num_shards)
+        ]
+        futures = [
+            self._executor.submit(shard.search_batch, query_embeddings, top_k, id_filter, shard_matches)
+            for shard, shard_matches in zip(shards, matches)
+        ]
+        shard_results = [future.result() for future in futures]
+
+        all_ids, all_scores = [], []
+        for row in range(len(query_embeddings)):
+            doc_ids = [doc_id for ids, _ in shard_results for doc_id in ids[row]]
+            scores = [score for _, shard_scores in shard_results for score in shard_scores[row]]
+            best = np.argsort(-np.asarray(scores, dtype='float32'), kind="stable")[:top_k]
+            all_ids.append([doc_ids[i] for i in best])
+            all_scores.append([scores[i] for i in best])
+
+        return all_ids, all_scores
+
+    def _residue_bitmap(self, shard_no: int, nbytes: int) -> np.ndarray:
+        # bit i set when id i routes to shard_no; a longer cached bitmap serves any shorter filter
+        residue = self._residues.get(shard_no)
+        if residue is None or len(residue) < nbytes:
+            ids = np.arange(nbytes * 8, dtype=np.int64)
+            residue = np.packbits(ids % self.num_shards == shard_no, bitorder="little")
+            self._residues[shard_no] = residue
+        return residue
+
+    @staticmethod
+    def shard_path(path: str, shard_no: int) -> str:
+        return f"{path}.shard{shard_no}"
+
+    def save(self, path: str):
+        for shard_no in range(self.num_shards):
+            self.save_shard(path, shard_no)
+
+    def save_shard(self, path: str, shard_no: int):
+        shard = self.shards[shard_no]
+        if shard.index is None:
+            shard.create_index()
+        shard.save(self.shard_path(path, shard_no))
+
+    def load(self, path: str, mmap: bool = settings.FAISS_MMAP):
+        loaded = 0
+        for shard_no in range(self.num_shards):
+            try:
+                self.load_shard(path, shard_no, mmap=mmap)
+                loaded += 1
+            except FileNotFoundError:
+                self.shards[shard_no].create_index()
+        if not loaded:
+            raise FileNotFoundError(f"No index shards found: {path}.shard*")
+
+    def load_shard(self, path: str, shard_no: int, mmap: bool = settings.FAISS_MMAP):
+        # the replacement is fully loaded before the swap, so queries never see a partial shard
+        shard = FAISSIndex(self.dimension, self.index_type, self.shards[shard_no].rerank)
+        shard.load(self.shard_path(path, shard_no), mmap=mmap)
+        self.shards[shard_no] = shard
+
+    def reload_changed(self, path: str) -> bool:
+        changed = False
+        for shard_no in range(self.num_shards):
+            if read_index_version(self.shard_path(path, shard_no)) > self.shards[shard_no].version:
+                try:
+                    self.load_shard(path, shard_no)
+                except Exception as e:
+                    # the shard keeps serving its current snapshot
+                    print(f"Failed to reload shard {shard_no}, keeping version {self.shards[shard_no].version}: {e}")
+                    continue
+                changed = True
+        return changed
+
+    @property
+    def version(self) -> int:
+        # shard versions only ever increase, so their sum changes whenever any shard does
+        return sum(shard.version for shard in self.shards)
+
+    @property
+    def shard_versions(self) -> List[int]:
+        return [shard.version for shard in self.shards]
+
+    @property
+    def id_map(self) -> np.ndarray:
+        return np.concatenate([shard.id_map for shard in self.shards])
+
+    @property
+    def size(self) -> int:
+        return sum(shard.size for shard in self.shards)
+
+    @property
+    def bytes_per_vector(self) -> float:
+        total = self.size
+        if not total:
+            return self.shards[0].bytes_per_vector
+        return sum(shard.bytes_per_vector * shard.size for shard in self.shards) / total
+
 
 _faiss_index = None
+_reload_lock = threading.Lock()
+_last_reload_check = 0.0
+
 
+def create_faiss_index(num_shards: int = settings.FAISS_NUM_SHARDS, **kwargs):
+    if num_shards > 1:
+        return ShardedFAISSIndex(num_shards=num_shards, **kwargs)
+    return FAISSIndex(**kwargs)
 
-def get_faiss_index() -> FAISSIndex:
+
+def _load_faiss_index():
+    faiss_index = create_faiss_index()
+    try:
+        faiss_index.load(settings.FAISS_INDEX_PATH)
+    except FileNotFoundError:
+        faiss_index.create_index()
+    return faiss_index
+
+
+def reload_faiss_index() -> bool:
     global _faiss_index
-    if _faiss_index is None:
-        _faiss_index = FAISSIndex()
+    # a reload already in progress keeps serving the current snapshot
+    if not _reload_lock.acquire(blocking=False):
+        return False
+    try:
+        current = _faiss_index
+        if current is None:
+            _faiss_index = _load_faiss_index()
+            return True
+        if isinstance(current, ShardedFAISSIndex):
+            return current.reload_changed(settings.FAISS_INDEX_PATH)
+        if read_index_version(settings.FAISS_INDEX_PATH) <= current.version:
+            return False
+        # no empty fallback here: a pointer to a pruned or half-copied snapshot
+        # must not replace the index that is serving
+        faiss_index = create_faiss_index()
         try:
-            _faiss_index.load(settings.FAISS_INDEX_PATH)
-        except FileNotFoundError:
-            _faiss_index.create_index()
+            faiss_index.load(settings.FAISS_INDEX_PATH)
+        except Exception as e:
+            print(f"Failed to reload FAISS index, keeping version {current.version}: {e}")
+            return False
+        # in-flight queries hold a reference to the old index and finish on it
+        _faiss_index = faiss_index
+        return True
+    finally:
+        _reload_lock.release()
+
+
+def get_faiss_index():
+    global _faiss_index, _last_reload_check
+    if _faiss_index is None:
+        with _reload_lock:
+            if _faiss_index is None:
+                _faiss_index = _load_faiss_index()
+                _last_reload_check = time.monotonic()
+    elif settings.FAISS_RELOAD_INTERVAL > 0 and time.monotonic() - _last_reload_check >= settings.FAISS_RELOAD_INTERVAL:
+        _last_reload_check = time.monotonic()
+        threading.Thread(target=reload_faiss_index, name="faiss-reload", daemon=True).start()
     return _faiss_index
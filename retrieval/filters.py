@@ -0,0 +1,93 @@
+import numpy as np
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional
+
+
+def _to_seconds(value: datetime) -> int:
+    return int(np.datetime64(value.replace(tzinfo=None), "s").astype(np.int64))
+
+
+# set bits per byte value, for counting matches without unpacking a bitmap
+_POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+def _bitmap_of(doc_ids: np.ndarray, num_ids: int) -> np.ndarray:
+    # a scratch bool scatter plus packbits beats bitwise_or.at by far on large id sets
+    mask = np.zeros(num_ids, dtype=bool)
+    mask[doc_ids] = True
+    return np.packbits(mask, bitorder="little")
+
+
+class DocumentFilter:
+    # Bitmap over Document.id (bit i set = paper i passes), in the little-endian
+    # layout FAISS's IDSelectorBitmap reads, plus the number of matching papers.
+
+    def __init__(self, bitmap: np.ndarray):
+        self.bitmap = bitmap
+        self.count = int(_POPCOUNT[bitmap].sum(dtype=np.int64))
+
+    def count_within(self, bitmap: np.ndarray) -> int:
+        # matches that are also set in `bitmap`, which must cover at least as many ids
+        return int(_POPCOUNT[self.bitmap & bitmap[:len(self.bitmap)]].sum(dtype=np.int64))
+
+    def contains(self, doc_ids: np.ndarray) -> np.ndarray:
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        inside = (doc_ids >= 0) & (doc_ids < len(self.bitmap) * 8)
+        found = np.zeros(len(doc_ids), dtype=bool)
+        ids = doc_ids[inside]
+        found[inside] = (self.bitmap[ids >> 3] >> (ids & 7)) & 1 == 1
+        return found
+
+    def selector(self):
+        import faiss
+        return faiss.IDSelectorBitmap(self.bitmap)
+
+
+class FilterIndex:
+    # Precomputed packed bitmaps per category and a date-sorted id array over
+    # Document.id, so a filter is assembled with a few ORs/ANDs over num_ids / 8 bytes.
+
+    def __init__(self, doc_ids: List[int], categories: List[Optional[str]], published: List[Optional[datetime]],
+                 version: int = 0):
+        self.version = version
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        self.num_ids = int(doc_ids.max()) + 1 if len(doc_ids) else 0
+
+        members: Dict[str, List[int]] = {}
+        for doc_id, doc_categories in zip(doc_ids, categories):
+            for category in (doc_categories or "").split(","):
+                category = category.strip()
+                if category:
+                    members.setdefault(category, []).append(doc_id)
+        self.category_bitmaps: Dict[str, np.ndarray] = {
+            category: _bitmap_of(np.asarray(ids, dtype=np.int64), self.num_ids) for category, ids in members.items()
+        }
+
+        dated = [(_to_seconds(value), doc_id) for doc_id, value in zip(doc_ids, published) if value is not None]
+        dated.sort()
+        self.dates = np.array([seconds for seconds, _ in dated], dtype=np.int64)
+        self.date_ids = np.array([doc_id for _, doc_id in dated], dtype=np.int64)
+
+    def build(self, categories: Optional[List[str]] = None, date_from: Optional[date] = None,
+              date_to: Optional[date] = None) -> DocumentFilter:
+        bitmap = None
+
+        if categories:
+            bitmap = np.zeros((self.num_ids + 7) // 8, dtype=np.uint8)
+            for category in categories:
+                if category in self.category_bitmaps:
+                    np.bitwise_or(bitmap, self.category_bitmaps[category], out=bitmap)
+
+        if date_from is not None or date_to is not None:
+            # both bounds are inclusive calendar days
+            lo = 0 if date_from is None else np.searchsorted(
+                self.dates, _to_seconds(datetime.combine(date_from, time.min)), side="left")
+            hi = len(self.dates) if date_to is None else np.searchsorted(
+                self.dates, _to_seconds(datetime.combine(date_to + timedelta(days=1), time.min)), side="left")
+            date_bitmap = _bitmap_of(self.date_ids[lo:hi], self.num_ids)
+            bitmap = date_bitmap if bitmap is None else np.bitwise_and(bitmap, date_bitmap, out=bitmap)
+
+        if bitmap is None:
+            # no conditions: every id up to num_ids passes
+            bitmap = np.packbits(np.ones(self.num_ids, dtype=bool), bitorder="little")
+        return DocumentFilter(bitmap)
@@ -0,0 +1,86 @@
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+import numpy as np
+
+STRING_COLUMNS = ("arxiv_id", "title", "authors", "abstract", "categories", "pdf_url")
+
+
+class StringColumn:
+    # Variable-length strings packed into one utf-8 blob; row i is
+    # blob[offsets[i]:offsets[i + 1]]. None is kept apart from "" in a null mask.
+
+    def __init__(self, values: Sequence[Optional[str]]):
+        encoded = [(value or "").encode("utf-8") for value in values]
+        self.offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum([len(value) for value in encoded])
+        self.blob = b"".join(encoded)
+        self.nulls = np.array([value is None for value in values], dtype=bool)
+
+    def __getitem__(self, row: int) -> Optional[str]:
+        if self.nulls[row]:
+            return None
+        return self.blob[self.offsets[row]:self.offsets[row + 1]].decode("utf-8")
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.blob) + self.offsets.nbytes + self.nulls.nbytes
+
+
+class MetadataStore:
+    # Read-only copy of the Document columns search results need, keyed by
+    # embedding_id through a dense position array, so a result page is assembled
+    # from memory instead of a Postgres round trip and ORM hydration.
+
+    def __init__(self, rows: List[Any], version: int = 0):
+        self.version = version
+        embedding_ids = np.array([row.embedding_id for row in rows], dtype=np.int64)
+        self.positions = np.full(int(embedding_ids.max()) + 1 if len(rows) else 0, -1, dtype=np.int32)
+        self.positions[embedding_ids] = np.arange(len(rows), dtype=np.int32)
+
+        self.ids = np.array([row.id for row in rows], dtype=np.int64)
+        self.embedding_ids = embedding_ids
+        # NaT stands in for NULL
+        self.published = np.array([
+            np.datetime64(row.published_date.replace(tzinfo=None), "us") if row.published_date else np.datetime64("NaT")
+            for row in rows
+        ], dtype="datetime64[us]")
+        self.columns = {name: StringColumn([getattr(row, name) for row in rows]) for name in STRING_COLUMNS}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _row(self, embedding_id: int) -> int:
+        if 0 <= embedding_id < len(self.positions):
+            return int(self.positions[embedding_id])
+        return -1
+
+    def get(self, embedding_id: int) -> Optional[Dict[str, Any]]:
+        row = self._row(embedding_id)
+        if row < 0:
+            return None
+
+        published = self.published[row]
+        # same shape as Document.to_dict()
+        return {
+            "id": int(self.ids[row]),
+            "arxiv_id": self.columns["arxiv_id"][row],
+            "title": self.columns["title"][row],
+            "authors": self.columns["authors"][row],
+            "abstract": self.columns["abstract"][row],
+            "categories": self.columns["categories"][row],
+            "published_date": None if np.isnat(published) else published.item().isoformat(),
+            "pdf_url": self.columns["pdf_url"][row],
+            "embedding_id": int(self.embedding_ids[row]),
+        }
+
+    def get_many(self, embedding_ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+        found = {}
+        for embedding_id in embedding_ids:
+            document = self.get(int(embedding_id))
+            if document is not None:
+                found[embedding_id] = document
+        return found
+
+    @property
+    def nbytes(self) -> int:
+        arrays = self.positions.nbytes + self.ids.nbytes + self.embedding_ids.nbytes + self.published.nbytes
+        return arrays + sum(column.nbytes for column in self.columns.values())
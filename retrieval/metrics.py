@@ -0,0 +1,55 @@
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, Tuple
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+
+# from sub-millisecond cache hits up to cold, re-ranked searches
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+SEARCH_STAGE_SECONDS = Histogram(
+    "scholarscope_search_stage_seconds", "Time spent in each search stage", ["stage"], buckets=LATENCY_BUCKETS
+)
+SEARCH_SECONDS = Histogram(
+    "scholarscope_search_seconds", "End-to-end search latency", ["mode"], buckets=LATENCY_BUCKETS
+)
+SEARCH_QUERIES = Counter(
+    "scholarscope_search_queries_total", "Queries served, by mode and response cache outcome", ["mode", "cache"]
+)
+SEARCH_ERRORS = Counter("scholarscope_search_errors_total", "Searches that raised", ["mode"])
+SEARCH_IN_FLIGHT = Gauge("scholarscope_search_in_flight", "Searches currently being served")
+REQUEST_QUEUE_DEPTH = Gauge("scholarscope_request_queue_depth", "Admitted requests waiting for a worker thread")
+REQUESTS_SHED = Counter("scholarscope_requests_shed_total", "Requests rejected with 503 because the queue was full")
+
+
+class StageTimer:
+    # Accumulates monotonic wall time per stage for one request and feeds the
+    # stage histogram; the totals double as the debug breakdown in responses.
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stages[name] = self.stages.get(name, 0.0) + elapsed
+            SEARCH_STAGE_SECONDS.labels(name).observe(elapsed)
+
+    def breakdown_ms(self) -> Dict[str, float]:
+        return {name: round(seconds * 1000, 3) for name, seconds in self.stages.items()}
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    # with several uvicorn workers each process writes its samples to
+    # PROMETHEUS_MULTIPROC_DIR and any worker can aggregate them on scrape
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    from prometheus_client import REGISTRY
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
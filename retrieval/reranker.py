@@ -0,0 +1,96 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+from app.config import get_settings
+
+settings = get_settings()
+
+
+class CrossEncoderReranker:
+    # Scores (query, paper) pairs with a cross-encoder, in batches, stopping before
+    # the batch that would overrun the caller's deadline. The cost per pair is
+    # tracked as a moving average so the last batch can be shrunk to fit. Scores
+    # are cached per (index version, query, paper), since the same paper can read
+    # differently after an --update.
+
+    def __init__(self, model_name: str = settings.CROSS_ENCODER_MODEL, batch_size: int = settings.CROSS_ENCODER_BATCH_SIZE,
+                 cache_size: int = settings.CROSS_ENCODER_CACHE_SIZE):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.model = None
+        self.seconds_per_pair = None
+        self.scored = 0
+        self.truncated = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load_model(self):
+        if self.model is None:
+            from sentence_transformers import CrossEncoder
+            print(f"Loading cross-encoder: {self.model_name}")
+            self.model = CrossEncoder(self.model_name)
+
+    def score(self, query: str, candidates: List[Tuple[int, str]], deadline: float,
+              version: int = 0) -> Dict[int, float]:
+        # returns scores for a prefix of candidates; whatever did not fit before the
+        # deadline is left out and keeps its first-stage rank
+        scores = {}
+        pending = []
+        with self._lock:
+            for doc_id, text in candidates:
+                key = (version, query, doc_id)
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    scores[doc_id] = self._cache[key]
+                else:
+                    pending.append((doc_id, text))
+
+        position = 0
+        while position < len(pending):
+            batch = pending[position:position + self.batch_size]
+            remaining = deadline - time.perf_counter()
+            if self.seconds_per_pair is not None:
+                batch = batch[:max(0, int(remaining / self.seconds_per_pair))]
+            if not batch or remaining <= 0:
+                break
+
+            self.load_model()
+            started = time.perf_counter()
+            batch_scores = self.model.predict(
+                [(query, text) for _, text in batch], batch_size=len(batch), show_progress_bar=False
+            )
+            per_pair = (time.perf_counter() - started) / len(batch)
+            self.seconds_per_pair = per_pair if self.seconds_per_pair is None else 0.8 * self.seconds_per_pair + 0.2 * per_pair
+
+            with self._lock:
+                for (doc_id, _), score in zip(batch, batch_scores):
+                    scores[doc_id] = float(score)
+                    self._cache[(version, query, doc_id)] = float(score)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            position += len(batch)
+
+        self.scored += position
+        self.truncated += len(pending) - position
+        return scores
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "model_name": self.model_name,
+            "scored_pairs": self.scored,
+            "truncated_pairs": self.truncated,
+            "ms_per_pair": self.seconds_per_pair * 1000 if self.seconds_per_pair else None,
+            "cache_size": len(self._cache),
+        }
+
+
+_reranker = None
+
+
+def get_reranker() -> CrossEncoderReranker:
+    global _reranker
+    if _reranker is None:
+        _reranker = CrossEncoderReranker()
+    return _reranker
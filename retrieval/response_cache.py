@@ -0,0 +1,82 @@
+import hashlib
+import json
+from typing import Any, Dict, List, Optional
+from app.config import get_settings
+from retrieval.lru import LRUCache
+
+settings = get_settings()
+
+
+class InMemoryResponseCache(LRUCache):
+    # Search results per worker process, in a bounded LRU with a TTL. Keys carry
+    # the index version, so a reload never serves stale results; the engine also
+    # clears it when the version changes.
+    pass
+
+
+class RankedIdCache(LRUCache):
+    # Export cursor token -> (doc_ids, scores) of a full-depth ranking, so deep
+    # pages and streams are served from one ranking instead of re-running the query.
+    pass
+
+
+class RedisResponseCache:
+    # Shared across workers and hosts. Entries expire after ttl_seconds; instead of
+    # being cleared on reload they become unreachable because keys embed the index
+    # version. Redis errors count as misses so a cache outage never fails a search.
+
+    def __init__(self, url: str, ttl_seconds: float = 300, prefix: str = "scholarscope:search:"):
+        import redis
+        self._redis = redis
+        self._client = redis.Redis.from_url(url)
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _name(self, key: str) -> str:
+        return self.prefix + hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        try:
+            raw = self._client.get(self._name(key))
+        except self._redis.RedisError:
+            self.errors += 1
+            raw = None
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(raw)
+
+    def put(self, key: str, value: List[Dict[str, Any]]):
+        try:
+            self._client.set(self._name(key), json.dumps(value), ex=int(self.ttl_seconds) or None)
+        except self._redis.RedisError:
+            self.errors += 1
+
+    def clear(self):
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "backend": "redis",
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+def create_response_cache(backend: str = settings.RESPONSE_CACHE_BACKEND):
+    if backend == "memory":
+        return InMemoryResponseCache(settings.RESPONSE_CACHE_SIZE, settings.RESPONSE_CACHE_TTL)
+    if backend == "redis":
+        if not settings.RESPONSE_CACHE_URL:
+            raise ValueError("RESPONSE_CACHE_URL must be set for the redis response cache")
+        return RedisResponseCache(settings.RESPONSE_CACHE_URL, settings.RESPONSE_CACHE_TTL)
+    if backend == "none":
+        return None
+    raise ValueError(f"Unknown response cache backend: {backend}")
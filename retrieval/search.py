@@ -1,56 +1,425 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Set, Union
+from datetime import date
+import hashlib
+import json
+import os
+import threading
 import time
+import numpy as np
 from sqlalchemy.orm import Session
-from app.models import Document, SearchLog
-from retrieval.faiss_index import get_faiss_index
+from app.config import get_settings
+from app.models import Document
+from retrieval.bm25 import BM25Index, reciprocal_rank_fusion
+from retrieval.filters import FilterIndex
+from retrieval.metadata_store import STRING_COLUMNS, MetadataStore
+from retrieval.metrics import SEARCH_ERRORS, SEARCH_IN_FLIGHT, SEARCH_QUERIES, SEARCH_SECONDS, StageTimer
+from retrieval.reranker import get_reranker
+from retrieval.response_cache import RankedIdCache, create_response_cache
+from retrieval.search_log import SearchLogWriter
 from ingestion.embeddings import get_embedding_generator
+from ingestion.embedding_cache import QueryEmbeddingCache
+from ingestion.query_batcher import QueryBatcher
+
+settings = get_settings()
+
+# dense: FAISS only; lexical: BM25 only; hybrid: both, fused by reciprocal rank
+SEARCH_MODES = ("dense", "lexical", "hybrid")
 
 
 class SemanticSearchEngine:
     def __init__(self):
-        self.faiss_index = get_faiss_index()
         self.embedding_generator = get_embedding_generator()
+        self.query_batcher = QueryBatcher(
+            self.embedding_generator,
+            window_ms=settings.QUERY_BATCH_WINDOW_MS,
+            max_batch_size=settings.QUERY_BATCH_MAX_SIZE
+        )
+        self._filter_index = None
+        self._filter_lock = threading.Lock()
+        self._next_filter_refresh = 0.0
+        self._bm25_index = None
+        self._bm25_lock = threading.Lock()
+        self.response_cache = create_response_cache()
+        self._response_cache_version = None
+        self.ranked_ids = RankedIdCache(settings.EXPORT_CURSOR_CACHE_SIZE, settings.EXPORT_CURSOR_TTL)
+        self.metadata_store = None
+        self._metadata_refresh = threading.Lock()
+        self._next_metadata_refresh = 0.0
+        self.log_writer = None
+        self._log_writer_lock = threading.Lock()
+        self.embedding_generator.add_model_change_hook(self._clear_response_cache)
+        self.ready = False
+    
+    @property
+    def faiss_index(self):
+        # imported lazily to keep faiss off the import path of the API module
+        from retrieval.faiss_index import get_faiss_index
+        # resolved per call so a hot-reloaded snapshot is picked up without a restart
+        return get_faiss_index()
+    
+    def _clear_response_cache(self, model_name: str):
+        # results ranked by the previous model are stale
+        if self.response_cache is not None:
+            self.response_cache.clear()
     
-    def search(self, query: str, top_k: int = 5, db: Session = None, log_search: bool = True):
+    def warmup(self, db: Optional[Session] = None):
+        # load the model and index and push one query through both, so the first
+        # real request does not pay for lazy initialisation
         start_time = time.time()
+        query_embeddings = self.embedding_generator.generate(["warmup query"])
+        self.faiss_index.search_batch(query_embeddings, top_k=1)
+        self.get_bm25_index()
+        if db is not None:
+            self.refresh_filter_index(db.get_bind())
+            if settings.METADATA_STORE_ENABLED:
+                self.refresh_metadata_store(db.get_bind())
+        if settings.CROSS_ENCODER_ENABLED:
+            get_reranker().load_model()
+        self.ready = True
+        print(f"✓ Search engine warm in {time.time() - start_time:.1f}s")
+    
+    def get_metadata_store(self, db: Session) -> Optional[MetadataStore]:
+        # Serves whatever store is loaded, even if the index has moved on: a newer
+        # version is built in the background and ids the current store does not
+        # know yet are looked up in Postgres meanwhile.
+        if not settings.METADATA_STORE_ENABLED:
+            return None
+        store = self.metadata_store
+        stale = store is None or store.version != self.faiss_index.version
+        # a failed refresh is retried at most every few seconds
+        if stale and not self._metadata_refresh.locked() and time.monotonic() >= self._next_metadata_refresh:
+            self._next_metadata_refresh = time.monotonic() + 5
+            threading.Thread(
+                target=self.refresh_metadata_store, args=(db.get_bind(),), name="metadata-refresh", daemon=True
+            ).start()
+        return store
+    
+    def refresh_metadata_store(self, bind):
+        # a caller arriving during a refresh waits for it and then finds the store current
+        with self._metadata_refresh:
+            version = self.faiss_index.version
+            if self.metadata_store is not None and self.metadata_store.version == version:
+                return
+            db = Session(bind=bind)
+            try:
+                rows = (
+                    db.query(Document.id, Document.embedding_id, Document.published_date,
+                             *[getattr(Document, name) for name in STRING_COLUMNS])
+                    .filter(Document.embedding_id.isnot(None))
+                    .all()
+                )
+                self.metadata_store = MetadataStore(rows, version=version)
+                print(f"✓ Metadata store: {len(rows)} papers, {self.metadata_store.nbytes / 1e6:.1f} MB (index v{version})")
+            except Exception as e:
+                print(f"Metadata store refresh failed: {e}")
+            finally:
+                db.close()
+    
+    def get_filter_index(self, db: Session) -> FilterIndex:
+        # Same lifecycle as the metadata store: after a version change the old
+        # filter index keeps serving while the new one is built in the background,
+        # so papers added since then are missing from filtered results until the
+        # swap. Only the very first build, with nothing to serve yet, is synchronous.
+        filter_index = self._filter_index
+        if filter_index is None:
+            self.refresh_filter_index(db.get_bind())
+            return self._filter_index
+        stale = filter_index.version != self.faiss_index.version
+        if stale and not self._filter_lock.locked() and time.monotonic() >= self._next_filter_refresh:
+            self._next_filter_refresh = time.monotonic() + 5
+            threading.Thread(
+                target=self.refresh_filter_index, args=(db.get_bind(),), name="filter-refresh", daemon=True
+            ).start()
+        return filter_index
+    
+    def refresh_filter_index(self, bind):
+        with self._filter_lock:
+            version = self.faiss_index.version
+            if self._filter_index is not None and self._filter_index.version == version:
+                return
+            db = Session(bind=bind)
+            try:
+                rows = (
+                    db.query(Document.embedding_id, Document.categories, Document.published_date)
+                    .filter(Document.embedding_id.isnot(None))
+                    .all()
+                )
+                self._filter_index = FilterIndex(
+                    [row.embedding_id for row in rows],
+                    [row.categories for row in rows],
+                    [row.published_date for row in rows],
+                    version=version
+                )
+            except Exception as e:
+                # with no index to fall back on the filtered search has to fail
+                if self._filter_index is None:
+                    raise
+                print(f"Filter index refresh failed: {e}")
+            finally:
+                db.close()
+    
+    def get_log_writer(self, db: Session) -> SearchLogWriter:
+        # bound to the first session's engine; there is one database per process
+        with self._log_writer_lock:
+            if self.log_writer is None:
+                self.log_writer = SearchLogWriter(db.get_bind())
+            return self.log_writer
+    
+    def get_bm25_index(self) -> Optional[BM25Index]:
+        # ingestion writes the BM25 file before the FAISS version pointer, so
+        # reloading on a version change picks up the matching lexical index
+        version = self.faiss_index.version
+        with self._bm25_lock:
+            if self._bm25_index is None or self._bm25_index.version != version:
+                path = BM25Index.path_for(settings.FAISS_INDEX_PATH)
+                if not os.path.exists(path):
+                    return None
+                self._bm25_index = BM25Index.load(path)
+                self._bm25_index.version = version
+            return self._bm25_index
+    
+    def search(self, query: str, top_k: int = 5, db: Session = None, log_search: bool = True,
+               categories: Optional[List[str]] = None, date_from: Optional[date] = None,
+               date_to: Optional[date] = None, mode: str = settings.SEARCH_MODE,
+               rerank: bool = settings.CROSS_ENCODER_ENABLED, timer: Optional[StageTimer] = None):
+        results, latency_ms = self.search_batch(
+            [query], top_k=top_k, db=db, log_search=log_search,
+            categories=categories, date_from=date_from, date_to=date_to, mode=mode, rerank=rerank, timer=timer
+        )
+        return results[0], latency_ms
+    
+    def search_batch(self, queries: List[str], top_k: Union[int, List[int]] = 5, db: Session = None, log_search: bool = True,
+                     categories: Optional[List[str]] = None, date_from: Optional[date] = None,
+                     date_to: Optional[date] = None, mode: str = settings.SEARCH_MODE,
+                     rerank: bool = settings.CROSS_ENCODER_ENABLED, timer: Optional[StageTimer] = None):
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode: {mode}")
+        # one top_k for the whole batch, or one per query
+        top_ks = [top_k] * len(queries) if isinstance(top_k, int) else list(top_k)
+        if len(top_ks) != len(queries):
+            raise ValueError("Need one top_k per query")
+        timer = timer or StageTimer()
         
-        query_embedding = self.embedding_generator.generate_query_embedding(query)
-        doc_ids, scores = self.faiss_index.search(query_embedding, top_k)
+        with SEARCH_IN_FLIGHT.track_inprogress():
+            try:
+                return self._search_batch(queries, top_ks, db, log_search, categories, date_from, date_to, mode, rerank, timer)
+            except Exception:
+                SEARCH_ERRORS.labels(mode).inc()
+                raise
+    
+    def _search_batch(self, queries: List[str], top_ks: List[int], db: Optional[Session], log_search: bool,
+                      categories: Optional[List[str]], date_from: Optional[date], date_to: Optional[date],
+                      mode: str, rerank: bool, timer: StageTimer):
+        start_time = time.perf_counter()
+        # the re-rank budget covers the whole request, not just the cross-encoder;
+        # this is the first query's deadline and each later one gets another budget
+        deadline = start_time + settings.CROSS_ENCODER_BUDGET_MS / 1000
         
-        results = []
+        # results are only cached when they came from the database
+        keys = None
+        all_results = [None] * len(queries)
+        if db is not None and self.response_cache is not None:
+            version = self.faiss_index.version
+            if version != self._response_cache_version:
+                self.response_cache.clear()
+                self._response_cache_version = version
+            keys = [
+                self._response_key(query, top_k, categories, date_from, date_to, mode, rerank, version)
+                for query, top_k in zip(queries, top_ks)
+            ]
+            with timer.stage("response_cache"):
+                for i, key in enumerate(keys):
+                    cached = self.response_cache.get(key)
+                    if cached is not None:
+                        all_results[i] = [dict(result) for result in cached]
         
-        if db:
-            documents = db.query(Document).filter(Document.embedding_id.in_(doc_ids)).all()
-            doc_map = {doc.embedding_id: doc for doc in documents}
-            
-            for doc_id, score in zip(doc_ids, scores):
-                if doc_id in doc_map:
-                    doc = doc_map[doc_id]
-                    results.append({
-                        **doc.to_dict(),
-                        "score": float(score),
-                        "rank": len(results) + 1
-                    })
+        missing = [i for i, results in enumerate(all_results) if results is None]
+        SEARCH_QUERIES.labels(mode, "hit").inc(len(queries) - len(missing))
+        SEARCH_QUERIES.labels(mode, "miss").inc(len(missing))
+        if missing:
+            # one pass at the deepest top_k; shallower queries take a prefix of their ranking
+            computed = self._search_uncached(
+                [queries[i] for i in missing], max(top_ks[i] for i in missing), db, categories, date_from, date_to,
+                mode, rerank, deadline, timer
+            )
+            for i, results in zip(missing, computed):
+                results = results[:top_ks[i]]
+                all_results[i] = results
+                # a re-rank cut short by the deadline is not worth repeating
+                if keys is not None and not any(result.get("rerank_score", 0.0) is None for result in results):
+                    self.response_cache.put(keys[i], [dict(result) for result in results])
         
-        latency_ms = (time.time() - start_time) * 1000
+        latency_ms = (time.perf_counter() - start_time) * 1000
         
         if log_search and db:
-            search_log = SearchLog(
-                query=query,
-                top_k=top_k,
-                latency_ms=latency_ms,
-                num_results=len(results)
-            )
-            db.add(search_log)
-            db.commit()
+            with timer.stage("log"):
+                log_writer = self.get_log_writer(db)
+                for query, top_k, results in zip(queries, top_ks, all_results):
+                    log_writer.log(query, top_k, latency_ms / len(queries), len(results))
+        
+        SEARCH_SECONDS.labels(mode).observe(time.perf_counter() - start_time)
+        return all_results, latency_ms
+    
+    def _search_uncached(self, queries: List[str], top_k: int, db: Optional[Session], categories: Optional[List[str]],
+                         date_from: Optional[date], date_to: Optional[date], mode: str, rerank: bool,
+                         deadline: float, timer: StageTimer) -> List[List[Dict[str, Any]]]:
+        id_filter = self._build_filter(db, categories, date_from, date_to, timer)
+        mode, bm25_index = self._resolve_mode(mode)
+        # re-ranking needs the documents' text, so it only runs with a database session
+        rerank = rerank and db is not None
+        keep = max(top_k, settings.CROSS_ENCODER_CANDIDATES) if rerank else top_k
+        all_doc_ids, all_scores = self._rank(queries, keep, mode, bm25_index, id_filter, timer)
+        
+        all_results = [[] for _ in queries]
         
-        return results, latency_ms
+        if db:
+            doc_map = self._fetch_documents({doc_id for doc_ids in all_doc_ids for doc_id in doc_ids}, db, timer)
+            for position, (query, results, doc_ids, scores) in enumerate(zip(queries, all_results, all_doc_ids, all_scores)):
+                candidates = [
+                    {**doc_map[doc_id], "score": float(score)}
+                    for doc_id, score in zip(doc_ids, scores) if doc_id in doc_map
+                ]
+                if rerank:
+                    # a batch re-ranks like the same queries sent one by one, instead
+                    # of the first few using up one shared budget
+                    query_deadline = deadline + position * settings.CROSS_ENCODER_BUDGET_MS / 1000
+                    with timer.stage("rerank"):
+                        candidates = self._rerank(query, candidates, query_deadline)
+                for candidate in candidates[:top_k]:
+                    results.append({**candidate, "rank": len(results) + 1})
+        
+        return all_results
+    
+    def _build_filter(self, db: Optional[Session], categories: Optional[List[str]], date_from: Optional[date],
+                      date_to: Optional[date], timer: StageTimer):
+        if not (categories or date_from or date_to):
+            return None
+        if db is None:
+            raise ValueError("Filtered search needs a database session")
+        with timer.stage("filter"):
+            return self.get_filter_index(db).build(categories, date_from, date_to)
+    
+    def _resolve_mode(self, mode: str):
+        bm25_index = self.get_bm25_index() if mode != "dense" else None
+        if bm25_index is None:
+            if mode == "lexical":
+                raise ValueError("Lexical search needs a BM25 index; run ingestion first")
+            # hybrid degrades to dense until a BM25 index has been built
+            mode = "dense"
+        return mode, bm25_index
+    
+    def _rank(self, queries: List[str], keep: int, mode: str, bm25_index: Optional[BM25Index], id_filter,
+              timer: StageTimer):
+        # fusion needs more than `keep` candidates from each side to re-order them
+        depth = max(keep, settings.HYBRID_CANDIDATES) if mode == "hybrid" else keep
+        
+        if mode != "lexical":
+            with timer.stage("encode"):
+                query_embeddings = self.query_batcher.encode(queries)
+            with timer.stage("faiss"):
+                all_doc_ids, all_scores = self.faiss_index.search_batch(query_embeddings, depth, id_filter=id_filter)
+        if mode != "dense":
+            with timer.stage("bm25"):
+                ranked = [bm25_index.search(query, depth, id_filter=id_filter) for query in queries]
+            if mode == "hybrid":
+                with timer.stage("fusion"):
+                    ranked = [
+                        reciprocal_rank_fusion([dense_ids, lexical_ids], keep)
+                        for dense_ids, (lexical_ids, _) in zip(all_doc_ids, ranked)
+                    ]
+            all_doc_ids = [doc_ids for doc_ids, _ in ranked]
+            all_scores = [scores for _, scores in ranked]
+        return all_doc_ids, all_scores
+    
+    def _fetch_documents(self, hit_ids: Set[int], db: Session, timer: StageTimer) -> Dict[int, Dict[str, Any]]:
+        with timer.stage("metadata"):
+            store = self.get_metadata_store(db)
+            doc_map = store.get_many(hit_ids) if store is not None else {}
+        # cold fallback for papers newer than the in-memory store
+        missing_ids = hit_ids - doc_map.keys()
+        if missing_ids:
+            with timer.stage("postgres"):
+                documents = db.query(Document).filter(Document.embedding_id.in_(missing_ids)).all()
+                doc_map.update({doc.embedding_id: doc.to_dict() for doc in documents})
+        return doc_map
+    
+    def rank_for_export(self, query: str, limit: int, db: Optional[Session] = None,
+                        categories: Optional[List[str]] = None, date_from: Optional[date] = None,
+                        date_to: Optional[date] = None, mode: str = settings.SEARCH_MODE) -> str:
+        # First-stage ranking at full depth, parked in ranked_ids under a token
+        # derived from the query, so the same export asked again reuses it. No
+        # cross-encoder: thousands of pairs cannot fit a request deadline.
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode: {mode}")
+        key = self._response_key(query, limit, categories, date_from, date_to, mode, False, self.faiss_index.version)
+        token = hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+        if self.ranked_ids.get(token) is None:
+            timer = StageTimer()
+            id_filter = self._build_filter(db, categories, date_from, date_to, timer)
+            mode, bm25_index = self._resolve_mode(mode)
+            all_doc_ids, all_scores = self._rank([query], limit, mode, bm25_index, id_filter, timer)
+            self.ranked_ids.put(token, (
+                np.asarray(all_doc_ids[0][:limit], dtype=np.int64), np.asarray(all_scores[0][:limit], dtype=np.float32)
+            ))
+        return token
+    
+    def ranked_page(self, doc_ids: np.ndarray, scores: np.ndarray, offset: int, size: int,
+                    db: Session) -> List[Dict[str, Any]]:
+        # ranks are positions in the stored ranking, so they stay stable across
+        # pages even if a paper is retracted in between
+        page_ids = [int(doc_id) for doc_id in doc_ids[offset:offset + size]]
+        doc_map = self._fetch_documents(set(page_ids), db, StageTimer())
+        return [
+            {**doc_map[doc_id], "score": float(score), "rank": offset + position + 1}
+            for position, (doc_id, score) in enumerate(zip(page_ids, scores[offset:offset + size]))
+            if doc_id in doc_map
+        ]
+    
+    @staticmethod
+    def _response_key(query: str, top_k: int, categories: Optional[List[str]], date_from: Optional[date],
+                      date_to: Optional[date], mode: str, rerank: bool, version: int) -> str:
+        return json.dumps([
+            QueryEmbeddingCache.normalize(query), top_k, sorted(categories or []),
+            date_from.isoformat() if date_from else None, date_to.isoformat() if date_to else None,
+            mode, rerank, version
+        ])
+    
+    def _rerank(self, query: str, candidates: List[Dict[str, Any]], deadline: float) -> List[Dict[str, Any]]:
+        scores = get_reranker().score(
+            query,
+            [(candidate["embedding_id"], f"{candidate['title']}. {candidate['abstract']}") for candidate in candidates],
+            deadline,
+            version=self.faiss_index.version
+        )
+        for candidate in candidates:
+            candidate["rerank_score"] = scores.get(candidate["embedding_id"])
+        # candidates the deadline cut off keep their first-stage order after the scored ones
+        scored = sorted((c for c in candidates if c["rerank_score"] is not None), key=lambda c: c["rerank_score"], reverse=True)
+        return scored + [c for c in candidates if c["rerank_score"] is None]
     
     def get_index_stats(self) -> Dict[str, Any]:
+        faiss_index = self.faiss_index
+        bm25_index = self.get_bm25_index()
         return {
-            "total_documents": self.faiss_index.size,
-            "embedding_dimension": self.faiss_index.dimension,
-            "model_name": self.embedding_generator.model_name
+            "total_documents": faiss_index.size,
+            "embedding_dimension": faiss_index.dimension,
+            "index_type": faiss_index.index_type,
+            "index_version": faiss_index.version,
+            "bytes_per_vector": faiss_index.bytes_per_vector,
+            "reranking": faiss_index.reranking,
+            "model_name": self.embedding_generator.model_name,
+            "query_cache": self.embedding_generator.query_cache.stats(),
+            "query_batcher": self.query_batcher.stats(),
+            "bm25_terms": len(bm25_index.vocabulary) if bm25_index is not None else 0,
+            "cross_encoder": get_reranker().stats(),
+            "response_cache": self.response_cache.stats() if self.response_cache is not None else None,
+            "export_cursors": self.ranked_ids.stats(),
+            "search_log": self.log_writer.stats() if self.log_writer is not None else None,
+            "metadata_store": {
+                "documents": len(self.metadata_store),
+                "bytes": self.metadata_store.nbytes,
+                "version": self.metadata_store.version
+            } if self.metadata_store is not None else None
         }
 
 
@@ -0,0 +1,113 @@
+import atexit
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from app.config import get_settings
+from app.models import SearchLog
+
+settings = get_settings()
+
+_STOP = object()
+
+
+class SearchLogWriter:
+    # Takes search_logs rows off the request path: log() only enqueues, and a
+    # background thread writes multi-row INSERTs once batch_size rows are waiting
+    # or flush_interval seconds have passed. When the queue is full, log() waits
+    # up to block_ms for space and then drops the row, counting it in `dropped`.
+
+    def __init__(self, bind, max_queue: int = settings.SEARCH_LOG_QUEUE_SIZE,
+                 batch_size: int = settings.SEARCH_LOG_BATCH_SIZE,
+                 flush_interval: float = settings.SEARCH_LOG_FLUSH_INTERVAL,
+                 block_ms: float = settings.SEARCH_LOG_BLOCK_MS):
+        self.bind = bind
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.block_ms = block_ms
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name="search-log-writer", daemon=True)
+        self._worker.start()
+        atexit.register(self.close)
+
+    def log(self, query: str, top_k: int, latency_ms: float, num_results: int):
+        row = {
+            "query": query,
+            "top_k": top_k,
+            "latency_ms": latency_ms,
+            "num_results": num_results,
+            "created_at": datetime.utcnow(),
+        }
+        if self._closed:
+            self.dropped += 1
+            return
+        try:
+            if self.block_ms > 0:
+                self._queue.put(row, timeout=self.block_ms / 1000)
+            else:
+                self._queue.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            stop = False
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            self._write(batch)
+            if stop:
+                return
+
+    def _write(self, rows):
+        db = Session(bind=self.bind)
+        try:
+            db.execute(insert(SearchLog), rows)
+            db.commit()
+            self.written += len(rows)
+            self.batches += 1
+        except Exception as e:
+            db.rollback()
+            self.failed += len(rows)
+            print(f"Failed to write {len(rows)} search logs: {e}")
+        finally:
+            db.close()
+
+    def close(self, timeout: float = 10.0):
+        # writes whatever is queued, then stops the worker
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._worker.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
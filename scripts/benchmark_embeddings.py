@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+import time
+import argparse
+from typing import List
+import numpy as np
+from ingestion.embeddings import EmbeddingGenerator
+
+
+def synthetic_corpus(num_texts: int, title_fraction: float = 0.2, seed: int = 0) -> List[str]:
+    # arXiv abstracts are roughly log-normal around 150 words (capped at ~300 by
+    # the 1920-character limit); titles run 8-15 words. Ingestion embeds
+    # "title. abstract", search and PDF chunking add shorter texts to the mix.
+    rng = np.random.default_rng(seed)
+    vocabulary = [
+        "model", "neural", "network", "learning", "graph", "retrieval", "attention", "training",
+        "language", "representation", "benchmark", "dataset", "transformer", "optimization",
+        "inference", "robust", "sparse", "embedding", "agent", "policy", "reward", "generative",
+        "diffusion", "contrastive", "semantic", "we", "propose", "show", "that", "the", "of", "a",
+        "and", "for", "on", "with", "results", "method", "approach", "performance", "state-of-the-art",
+    ]
+
+    texts = []
+    for _ in range(num_texts):
+        title = " ".join(rng.choice(vocabulary, size=rng.integers(8, 16)))
+        if rng.random() < title_fraction:
+            texts.append(title)
+            continue
+        words = int(np.clip(rng.lognormal(mean=np.log(150), sigma=0.45), 30, 300))
+        texts.append(f"{title}. {' '.join(rng.choice(vocabulary, size=words))}")
+    return texts
+
+
+def database_corpus(num_texts: int) -> List[str]:
+    from app.models import Document, SessionLocal
+    db = SessionLocal()
+    try:
+        documents = db.query(Document.title, Document.abstract).limit(num_texts).all()
+    finally:
+        db.close()
+    return [f"{doc.title}. {doc.abstract}" for doc in documents]
+
+
+def benchmark(texts: List[str], batch_tokens: int, repeats: int) -> tuple:
+    generator = EmbeddingGenerator(cache_path="", num_workers=1, batch_tokens=batch_tokens)
+    generator.generate(texts[:64])  # load the model and warm up kernels
+
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        embeddings = generator.generate(texts)
+        best = min(best, time.perf_counter() - start)
+    return len(texts) / best, embeddings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare fixed-size and token-budget embedding batching")
+    parser.add_argument("--num-texts", type=int, default=2000)
+    parser.add_argument("--source", choices=["synthetic", "db"], default="synthetic")
+    parser.add_argument("--title-fraction", type=float, default=0.2, help="Share of title-only texts (synthetic)")
+    parser.add_argument("--batch-tokens", type=int, nargs="+", default=[4096, 8192, 16384])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.source == "db":
+        texts = database_corpus(args.num_texts)
+    else:
+        texts = synthetic_corpus(args.num_texts, args.title_fraction)
+
+    lengths = np.array(EmbeddingGenerator(cache_path="").token_lengths(texts))
+    print(f"{len(texts)} texts, tokens p50={np.median(lengths):.0f} p90={np.percentile(lengths, 90):.0f} max={lengths.max()}")
+
+    baseline, reference = benchmark(texts, batch_tokens=0, repeats=args.repeats)
+    print(f"\n{'batching':<24}{'texts/sec':>12}{'speedup':>10}{'max diff':>12}")
+    print(f"{'fixed (32 texts)':<24}{baseline:>12.1f}{1.0:>10.2f}{0.0:>12.1e}")
+    for batch_tokens in args.batch_tokens:
+        throughput, embeddings = benchmark(texts, batch_tokens=batch_tokens, repeats=args.repeats)
+        diff = float(np.abs(embeddings - reference).max())
+        print(f"{f'{batch_tokens} token budget':<24}{throughput:>12.1f}{throughput / baseline:>10.2f}{diff:>12.1e}")
+
+
+if __name__ == "__main__":
+    main()
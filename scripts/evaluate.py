@@ -16,7 +16,8 @@ def calculate_recall_at_k(retrieved: List[str], relevant: List[str], k: int) ->
     return len(retrieved_k & relevant_set) / len(relevant_set)
 
 
-def evaluate_retrieval(eval_data: List[Dict], k_values: List[int] = [1, 5, 10]):
+def evaluate_retrieval(eval_data: List[Dict], k_values: List[int] = [1, 5, 10], batch_size: int = 64,
+                       mode: str = "dense"):
     search_engine = get_search_engine()
     db = SessionLocal()
     
@@ -28,25 +29,26 @@ def evaluate_retrieval(eval_data: List[Dict], k_values: List[int] = [1, 5, 10]):
     
     print(f"Evaluating on {len(eval_data)} queries...")
     
-    for item in eval_data:
-        query = item["query"]
-        relevant_docs = item["relevant_docs"]
+    for start in range(0, len(eval_data), batch_size):
+        batch = eval_data[start:start + batch_size]
         
         start_time = time.time()
-        search_results, latency = search_engine.search(
-            query=query,
+        batch_results, latency = search_engine.search_batch(
+            queries=[item["query"] for item in batch],
             top_k=max(k_values),
             db=db,
-            log_search=False
+            log_search=False,
+            mode=mode
         )
         latency_ms = (time.time() - start_time) * 1000
-        results["latencies"].append(latency_ms)
+        results["latencies"].extend([latency_ms / len(batch)] * len(batch))
         
-        retrieved_ids = [r["arxiv_id"] for r in search_results]
-        
-        for k in k_values:
-            recall = calculate_recall_at_k(retrieved_ids, relevant_docs, k)
-            results["recall"][k].append(recall)
+        for item, search_results in zip(batch, batch_results):
+            retrieved_ids = [r["arxiv_id"] for r in search_results]
+            
+            for k in k_values:
+                recall = calculate_recall_at_k(retrieved_ids, item["relevant_docs"], k)
+                results["recall"][k].append(recall)
     
     db.close()
     
@@ -64,7 +66,7 @@ def print_results(results: Dict):
     print("EVALUATION RESULTS")
     print("="*50)
     print(f"Total Queries: {results['total_queries']}")
-    print(f"Avg Latency: {results['avg_latency_ms']:.2f}ms")
+    print(f"Avg Latency: {results['avg_latency_ms']:.2f}ms per query (batched)")
     print("\nRecall@K:")
     for k, value in results['recall'].items():
         print(f"  R@{k}: {value:.4f}")
@@ -74,12 +76,14 @@ def print_results(results: Dict):
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--dataset", type=str, default="data/eval_queries.json")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--mode", choices=["dense", "lexical", "hybrid"], default="dense")
     args = parser.parse_args()
     
     with open(args.dataset, 'r') as f:
         eval_data = json.load(f)
     
-    results = evaluate_retrieval(eval_data)
+    results = evaluate_retrieval(eval_data, batch_size=args.batch_size, mode=args.mode)
     print_results(results)
 
 
@@ -1,7 +1,15 @@
 import pytest
+import time
 import numpy as np
-from retrieval.faiss_index import FAISSIndex
-from ingestion.embeddings import EmbeddingGenerator
+import retrieval.faiss_index as faiss_index_module
+from datetime import date, datetime
+from retrieval.faiss_index import FAISSIndex, ShardedFAISSIndex, read_index_version
+from retrieval.filters import FilterIndex
+from retrieval.bm25 import BM25Index, reciprocal_rank_fusion, tokenize
+from retrieval.reranker import CrossEncoderReranker
+from ingestion.embeddings import EmbeddingGenerator, _token_budget_batches
+from ingestion.embedding_cache import EmbeddingCache, QueryEmbeddingCache
+from ingestion.query_batcher import QueryBatcher
 
 
 class TestFAISSIndex:
@@ -35,6 +43,743 @@ class TestFAISSIndex:
         
         assert len(results) == 5
         assert len(scores) == 5
+    
+    def test_search_batch_matches_single_queries(self):
+        index = FAISSIndex(dimension=384)
+        index.add_embeddings(np.random.rand(100, 384).astype('float32'), list(range(100)))
+        
+        queries = np.random.rand(4, 384).astype('float32')
+        batch_ids, batch_scores = index.search_batch(queries, top_k=5)
+        
+        assert len(batch_ids) == 4
+        for query, ids, scores in zip(queries, batch_ids, batch_scores):
+            single_ids, single_scores = index.search(query, top_k=5)
+            assert ids == single_ids
+            assert scores == pytest.approx(single_scores)
+    
+    @pytest.mark.parametrize("index_type", ["ivf", "hnsw"])
+    def test_approximate_index_finds_exact_match(self, index_type):
+        index = FAISSIndex(dimension=384, index_type=index_type)
+        
+        embeddings = np.random.rand(200, 384).astype('float32')
+        index.train(embeddings.copy())
+        index.add_embeddings(embeddings.copy(), list(range(200)))
+        assert index.size == 200
+        
+        results, scores = index.search(embeddings[42].copy(), top_k=5)
+        assert results[0] == 42
+        assert len(results) == 5
+    
+    def test_save_and_load_preserves_index_type(self, tmp_path):
+        index = FAISSIndex(dimension=384, index_type="ivf")
+        index.add_embeddings(np.random.rand(50, 384).astype('float32'), list(range(50)))
+        index.save(str(tmp_path / "idx"))
+        
+        loaded = FAISSIndex(dimension=384)
+        loaded.load(str(tmp_path / "idx"))
+        assert loaded.index_type == "ivf"
+        assert loaded.size == 50
+    
+    @pytest.mark.parametrize("index_type,code_size", [("sq8", 392), ("fp16", 776), ("pq", 56)])
+    def test_compressed_index_bytes_per_vector(self, index_type, code_size):
+        index = FAISSIndex(dimension=384, index_type=index_type)
+        index.add_embeddings(np.random.rand(300, 384).astype('float32'), list(range(300)))
+        
+        assert index.bytes_per_vector == code_size
+    
+    def test_pq_rerank_returns_exact_scores(self, tmp_path):
+        index = FAISSIndex(dimension=384, index_type="pq", rerank=True)
+        embeddings = np.random.rand(300, 384).astype('float32')
+        index.add_embeddings(embeddings.copy(), list(range(300)))
+        index.save(str(tmp_path / "idx"))
+        
+        loaded = FAISSIndex(dimension=384, rerank=True)
+        loaded.load(str(tmp_path / "idx"))
+        assert loaded.vectors is not None
+        
+        results, scores = loaded.search(embeddings[7].copy(), top_k=3)
+        assert results[0] == 7
+        assert scores[0] == pytest.approx(1.0, abs=1e-5)
+        assert scores == sorted(scores, reverse=True)
+    
+    def test_mmap_load_is_shared_and_writable_on_demand(self, tmp_path):
+        path = str(tmp_path / "idx")
+        index = FAISSIndex(dimension=384)
+        index.add_embeddings(np.random.rand(20, 384).astype('float32'), list(range(100, 120)))
+        index.save(path)
+        
+        loaded = FAISSIndex(dimension=384)
+        loaded.load(path, mmap=True)
+        assert loaded.mmapped
+        assert loaded.id_map.dtype == np.int64
+        
+        loaded.add_embeddings(np.random.rand(5, 384).astype('float32'), list(range(120, 125)))
+        assert not loaded.mmapped
+        assert loaded.size == 25
+        loaded.save(path)
+        
+        reloaded = FAISSIndex(dimension=384)
+        reloaded.load(path, mmap=True)
+        assert reloaded.id_map.tolist() == list(range(100, 125))
+    
+    @pytest.mark.parametrize("index_type", ["flat", "ivf", "hnsw", "sq8"])
+    def test_remove_and_replace_by_document_id(self, index_type):
+        index = FAISSIndex(dimension=384, index_type=index_type)
+        embeddings = np.random.rand(100, 384).astype('float32')
+        index.add_embeddings(embeddings.copy(), list(range(1000, 1100)))
+        
+        assert index.remove([1010, 1020]) == 2
+        assert index.size == 98
+        results, _ = index.search(embeddings[10].copy(), top_k=5)
+        assert 1010 not in results
+        
+        replacement = np.random.rand(1, 384).astype('float32')
+        index.replace(replacement.copy(), [1030])
+        assert index.size == 98
+        results, _ = index.search(replacement[0].copy(), top_k=1)
+        assert results == [1030]
+    
+    def test_load_migrates_positional_id_map(self, tmp_path):
+        import faiss
+        import pickle
+        
+        path = str(tmp_path / "legacy")
+        legacy = faiss.IndexFlatIP(384)
+        embeddings = np.random.rand(10, 384).astype('float32')
+        faiss.normalize_L2(embeddings)
+        legacy.add(embeddings)
+        faiss.write_index(legacy, f"{path}.index")
+        with open(f"{path}.map", "wb") as f:
+            pickle.dump(list(range(50, 60)), f)
+        
+        index = FAISSIndex(dimension=384)
+        index.load(path)
+        assert sorted(index.id_map.tolist()) == list(range(50, 60))
+        results, _ = index.search(embeddings[3], top_k=1)
+        assert results == [53]
+    
+    def test_save_writes_versioned_snapshots(self, tmp_path):
+        path = str(tmp_path / "idx")
+        index = FAISSIndex(dimension=384)
+        index.add_embeddings(np.random.rand(5, 384).astype('float32'), list(range(5)))
+        for _ in range(3):
+            index.save(path)
+        
+        assert read_index_version(path) == 3
+        assert not (tmp_path / "idx.v1.index").exists()
+        assert (tmp_path / "idx.v2.index").exists()
+        
+        loaded = FAISSIndex(dimension=384)
+        loaded.load(path)
+        assert loaded.version == 3
+    
+    def test_reload_swaps_in_new_snapshot(self, tmp_path, monkeypatch):
+        path = str(tmp_path / "idx")
+        monkeypatch.setattr(faiss_index_module.settings, "FAISS_INDEX_PATH", path)
+        monkeypatch.setattr(faiss_index_module, "_faiss_index", None)
+        
+        writer = FAISSIndex(dimension=384)
+        writer.add_embeddings(np.random.rand(5, 384).astype('float32'), list(range(5)))
+        writer.save(path)
+        
+        serving = faiss_index_module.get_faiss_index()
+        assert serving.version == 1
+        assert not faiss_index_module.reload_faiss_index()
+        
+        writer.add_embeddings(np.random.rand(5, 384).astype('float32'), list(range(5, 10)))
+        writer.save(path)
+        
+        assert faiss_index_module.reload_faiss_index()
+        assert faiss_index_module._faiss_index.version == 2
+        assert faiss_index_module._faiss_index.size == 10
+        assert serving.size == 5
+    
+    def test_reload_keeps_serving_when_snapshot_is_missing(self, tmp_path, monkeypatch):
+        import json
+        path = str(tmp_path / "idx")
+        monkeypatch.setattr(faiss_index_module.settings, "FAISS_INDEX_PATH", path)
+        monkeypatch.setattr(faiss_index_module, "_faiss_index", None)
+        
+        writer = FAISSIndex(dimension=384)
+        writer.add_embeddings(np.random.rand(5, 384).astype('float32'), list(range(5)))
+        writer.save(path)
+        serving = faiss_index_module.get_faiss_index()
+        
+        with open(f"{path}.version", "w") as f:
+            json.dump({"version": 7}, f)
+        
+        assert not faiss_index_module.reload_faiss_index()
+        assert faiss_index_module._faiss_index is serving
+        assert serving.size == 5
+    
+    def test_sharded_reload_keeps_shard_when_snapshot_is_missing(self, tmp_path):
+        import json
+        path = str(tmp_path / "idx")
+        sharded = ShardedFAISSIndex(num_shards=2, dimension=384)
+        sharded.add_embeddings(np.random.rand(10, 384).astype('float32'), list(range(10)))
+        sharded.save(path)
+        loaded = ShardedFAISSIndex(num_shards=2, dimension=384)
+        loaded.load(path)
+        
+        with open(f"{ShardedFAISSIndex.shard_path(path, 0)}.version", "w") as f:
+            json.dump({"version": 7}, f)
+        
+        assert not loaded.reload_changed(path)
+        assert loaded.size == 10
+    
+    def test_concurrent_search_and_append(self):
+        from concurrent.futures import ThreadPoolExecutor
+        
+        index = FAISSIndex(dimension=384)
+        index.add_embeddings(np.random.rand(50, 384).astype('float32'), list(range(50)))
+        
+        def append(batch_no):
+            start = 50 + batch_no * 10
+            index.add_embeddings(np.random.rand(10, 384).astype('float32'), list(range(start, start + 10)))
+        
+        def search(_):
+            results, _ = index.search(np.random.rand(384).astype('float32'), top_k=5)
+            return len(results)
+        
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            writes = [pool.submit(append, i) for i in range(20)]
+            reads = [pool.submit(search, i) for i in range(200)]
+            assert all(read.result() == 5 for read in reads)
+            for write in writes:
+                write.result()
+        
+        assert index.size == 250
+        assert sorted(index.id_map.tolist()) == list(range(250))
+    
+    def test_unknown_index_type(self):
+        with pytest.raises(ValueError):
+            FAISSIndex(dimension=384, index_type="lsh")
+
+
+class TestShardedFAISSIndex:
+    def test_search_matches_single_index(self):
+        embeddings = np.random.rand(200, 384).astype('float32')
+        doc_ids = list(range(1, 201))
+        
+        single = FAISSIndex(dimension=384)
+        single.add_embeddings(embeddings.copy(), doc_ids)
+        sharded = ShardedFAISSIndex(num_shards=3, dimension=384)
+        sharded.add_embeddings(embeddings.copy(), doc_ids)
+        
+        assert sharded.size == 200
+        assert all(shard.size > 0 for shard in sharded.shards)
+        
+        query = np.random.rand(384).astype('float32')
+        expected, expected_scores = single.search(query, top_k=10)
+        results, scores = sharded.search(query, top_k=10)
+        assert results == expected
+        assert scores == pytest.approx(expected_scores, abs=1e-5)
+    
+    def test_shards_save_and_load_independently(self, tmp_path):
+        path = str(tmp_path / "idx")
+        sharded = ShardedFAISSIndex(num_shards=2, dimension=384)
+        sharded.add_embeddings(np.random.rand(10, 384).astype('float32'), list(range(10)))
+        sharded.save(path)
+        
+        rebuilt = FAISSIndex(dimension=384)
+        rebuilt.add_embeddings(np.random.rand(3, 384).astype('float32'), [20, 22, 24])
+        rebuilt.save(ShardedFAISSIndex.shard_path(path, 0))
+        
+        loaded = ShardedFAISSIndex(num_shards=2, dimension=384)
+        loaded.load(path)
+        assert loaded.shards[0].size == 3
+        assert loaded.shards[1].size == 5
+        assert sorted(loaded.id_map.tolist()) == [1, 3, 5, 7, 9, 20, 22, 24]
+
+
+class TestFilteredSearch:
+    def make_filter_index(self):
+        doc_ids = list(range(1, 301))
+        categories = ["cs.AI, cs.LG" if i % 10 == 0 else "cs.CV" for i in doc_ids]
+        published = [datetime(2024, 1, 1 + i % 28) for i in doc_ids]
+        return FilterIndex(doc_ids, categories, published)
+    
+    def test_build_filter(self):
+        filters = self.make_filter_index()
+        
+        assert filters.build(categories=["cs.LG"]).count == 30
+        assert filters.build(categories=["cs.LG", "cs.CV"]).count == 300
+        assert filters.build(categories=["math.CO"]).count == 0
+        
+        by_day = filters.build(date_from=date(2024, 1, 5), date_to=date(2024, 1, 5))
+        assert by_day.count == sum(1 for i in range(1, 301) if 1 + i % 28 == 5)
+    
+    def test_categories_are_packed_bitmaps(self):
+        filters = self.make_filter_index()
+        assert all(bitmap.dtype == np.uint8 and len(bitmap) == 38 for bitmap in filters.category_bitmaps.values())
+        
+        id_filter = filters.build(categories=["cs.AI"], date_from=date(2024, 1, 10))
+        expected = [i for i in range(1, 301) if i % 10 == 0 and 1 + i % 28 >= 10]
+        assert np.flatnonzero(id_filter.contains(np.arange(-1, 400))).tolist() == [i + 1 for i in expected]
+        assert id_filter.count == len(expected)
+    
+    @pytest.mark.parametrize("index_type", ["flat", "ivf", "hnsw", "sq8", "fp16", "pq"])
+    def test_filtered_search_returns_top_k_matches(self, index_type):
+        filters = self.make_filter_index()
+        index = FAISSIndex(dimension=384, index_type=index_type)
+        index.add_embeddings(np.random.rand(300, 384).astype('float32'), list(range(1, 301)))
+        
+        id_filter = filters.build(categories=["cs.AI"], date_from=date(2024, 1, 10))
+        results, scores = index.search(np.random.rand(384).astype('float32'), top_k=8, id_filter=id_filter)
+        
+        assert len(results) == 8
+        assert all(doc_id % 10 == 0 and 1 + doc_id % 28 >= 10 for doc_id in results)
+    
+    def test_sharded_filter_counts_matches_per_shard(self, monkeypatch):
+        # shard 1 (odd ids) holds only 3 matches, fewer than k
+        doc_ids = list(range(1, 301))
+        selected = {1, 3, 5} | set(range(2, 41, 2))
+        filters = FilterIndex(doc_ids, ["cs.AI" if i in selected else "cs.CV" for i in doc_ids], [None] * 300)
+        id_filter = filters.build(categories=["cs.AI"])
+        monkeypatch.setattr(faiss_index_module.settings, "FAISS_NPROBE", 1000)
+        index = ShardedFAISSIndex(num_shards=2, dimension=384, index_type="ivf")
+        index.add_embeddings(np.random.rand(300, 384).astype('float32'), doc_ids)
+        
+        exhaustive = []
+        search_params = FAISSIndex._search_params
+        
+        def record(self, top_k, selector=None, exhaustive_scan=False):
+            exhaustive.append(exhaustive_scan)
+            return search_params(self, top_k, selector, exhaustive_scan)
+        
+        monkeypatch.setattr(FAISSIndex, "_search_params", record)
+        results, _ = index.search(np.random.rand(384).astype('float32'), top_k=8, id_filter=id_filter)
+        
+        assert len(results) == 8 and set(results) <= selected
+        assert not any(exhaustive)
+    
+    def test_filtered_pq_search_on_shards(self):
+        filters = self.make_filter_index()
+        index = ShardedFAISSIndex(num_shards=2, dimension=384, index_type="pq", rerank=True)
+        index.add_embeddings(np.random.rand(300, 384).astype('float32'), list(range(1, 301)))
+        
+        id_filter = filters.build(categories=["cs.AI"])
+        results, _ = index.search(np.random.rand(384).astype('float32'), top_k=30, id_filter=id_filter)
+        
+        assert sorted(results) == list(range(10, 301, 10))
+
+
+class TestBM25Index:
+    TEXTS = {
+        3: "Attention is all you need. Transformers replace recurrence with attention. Vaswani 1706.03762",
+        5: "Graph neural networks for molecules. Message passing on molecular graphs. Gilmer 1704.01212",
+        8: "BERT: pre-training of deep bidirectional transformers. Devlin 1810.04805",
+        9: "Dense passage retrieval for open-domain question answering. Karpukhin 2004.04906",
+    }
+    
+    def build(self):
+        return BM25Index.build(list(self.TEXTS), list(self.TEXTS.values()))
+    
+    def test_tokenize_keeps_arxiv_ids(self):
+        assert tokenize("See 2401.01234v2, BERT-base!") == ["see", "2401.01234", "v2", "bert", "base"]
+    
+    def test_exact_terms_rank_first(self):
+        index = self.build()
+        assert index.search("Karpukhin", top_k=3)[0] == [9]
+        assert index.search("1704.01212")[0] == [5]
+        doc_ids, scores = index.search("transformers attention", top_k=2)
+        assert doc_ids == [3, 8]
+        assert scores[0] > scores[1] > 0
+    
+    def test_unknown_terms_return_nothing(self):
+        assert self.build().search("zyzzyva") == ([], [])
+    
+    def test_filter_excludes_documents(self):
+        filters = FilterIndex([3, 5, 8, 9], ["cs.CL", "cs.LG", "cs.CL", "cs.IR"], [None] * 4)
+        doc_ids, _ = self.build().search("transformers", id_filter=filters.build(categories=["cs.LG", "cs.IR"]))
+        assert doc_ids == []
+    
+    def test_save_and_load_round_trip(self, tmp_path):
+        index = self.build()
+        path = BM25Index.path_for(str(tmp_path / "faiss_index"))
+        index.save(path)
+        loaded = BM25Index.load(path)
+        
+        assert loaded.vocabulary == index.vocabulary
+        for query in ("transformers", "molecular graphs", "devlin bert"):
+            assert loaded.search(query) == index.search(query)
+    
+    def test_reciprocal_rank_fusion(self):
+        doc_ids, scores = reciprocal_rank_fusion([[1, 2, 3], [3, 4, 1]], top_k=3, k=60)
+        assert doc_ids == [1, 3, 2]
+        assert scores[0] == pytest.approx(1 / 61 + 1 / 63)
+
+
+class FakeCrossEncoder:
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.pairs = []
+    
+    def predict(self, pairs, batch_size=32, show_progress_bar=False):
+        self.pairs.extend(pairs)
+        time.sleep(self.delay * len(pairs))
+        return np.array([float(len(text)) for _, text in pairs])
+
+
+class TestCrossEncoderReranker:
+    def reranker(self, delay: float = 0.0, batch_size: int = 2):
+        reranker = CrossEncoderReranker(model_name="test", batch_size=batch_size, cache_size=100)
+        reranker.model = FakeCrossEncoder(delay)
+        return reranker
+    
+    def test_scores_all_candidates_within_budget(self):
+        reranker = self.reranker()
+        candidates = [(1, "a"), (2, "ccc"), (3, "bb")]
+        scores = reranker.score("q", candidates, deadline=time.perf_counter() + 10)
+        assert scores == {1: 1.0, 2: 3.0, 3: 2.0}
+        assert reranker.stats()["truncated_pairs"] == 0
+    
+    def test_repeated_queries_hit_the_cache(self):
+        reranker = self.reranker()
+        candidates = [(1, "a"), (2, "ccc")]
+        reranker.score("q", candidates, deadline=time.perf_counter() + 10)
+        reranker.score("q", candidates, deadline=time.perf_counter() + 10)
+        assert len(reranker.model.pairs) == 2
+        
+        reranker.score("q", candidates, deadline=time.perf_counter() + 10, version=2)
+        assert len(reranker.model.pairs) == 4
+    
+    def test_deadline_truncates_candidates(self):
+        reranker = self.reranker(delay=0.02, batch_size=2)
+        candidates = [(i, "x" * i) for i in range(1, 21)]
+        scores = reranker.score("q", candidates, deadline=time.perf_counter() + 0.1)
+        
+        assert 0 < len(scores) < len(candidates)
+        # the first-stage head is scored first
+        assert set(scores) == set(range(1, len(scores) + 1))
+        assert reranker.stats()["truncated_pairs"] == len(candidates) - len(scores)
+    
+    def test_expired_deadline_scores_nothing(self):
+        reranker = self.reranker()
+        assert reranker.score("q", [(1, "a")], deadline=time.perf_counter() - 1) == {}
+
+
+@pytest.fixture
+def search_env(tmp_path, monkeypatch):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from sqlalchemy.pool import StaticPool
+    from app.models import Base, Document
+    import retrieval.search as search_module
+    
+    monkeypatch.setattr(search_module.settings, "FAISS_INDEX_PATH", str(tmp_path / "faiss_index"))
+    monkeypatch.setattr(search_module.settings, "FAISS_RELOAD_INTERVAL", 0)
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    
+    topics = ["graph neural networks", "transformers", "diffusion models", "dense retrieval"]
+    docs = [Document(arxiv_id=f"2401.0000{i}", title=topic, abstract=f"A paper about {topic}.") for i, topic in enumerate(topics)]
+    db.add_all(docs)
+    db.flush()
+    for doc in docs:
+        doc.embedding_id = doc.id
+    db.commit()
+    
+    index = FAISSIndex(dimension=8)
+    index.create_index()
+    index.add_embeddings(np.random.rand(len(docs), 8).astype('float32'), [doc.id for doc in docs])
+    monkeypatch.setattr(faiss_index_module, "_faiss_index", index)
+    BM25Index.build([doc.id for doc in docs], [f"{doc.title} {doc.abstract}" for doc in docs]).save(
+        BM25Index.path_for(str(tmp_path / "faiss_index")))
+    
+    search_engine = search_module.SemanticSearchEngine()
+    encoded = []
+    
+    def fake_encode(queries):
+        encoded.extend(queries)
+        return np.random.rand(len(queries), 8).astype('float32')
+    
+    monkeypatch.setattr(search_engine.query_batcher, "encode", fake_encode)
+    yield search_engine, db, index, encoded
+    db.close()
+
+
+@pytest.fixture
+def api_client(search_env, monkeypatch):
+    from fastapi.testclient import TestClient
+    import app.api as api_module
+    search_engine, db, _, encoded = search_env
+    monkeypatch.setattr(api_module, "get_search_engine", lambda: search_engine)
+    monkeypatch.setattr(api_module.settings, "WARMUP_ON_STARTUP", False)
+    api_module.app.dependency_overrides[api_module.get_db] = lambda: db
+    try:
+        with TestClient(api_module.app) as client:
+            yield client, search_engine, encoded
+    finally:
+        api_module.app.dependency_overrides.clear()
+
+
+class TestSearchEngine:
+    def test_lexical_and_hybrid_modes(self, search_env):
+        search_engine, db, _, _ = search_env
+        results, _ = search_engine.search("diffusion", top_k=2, db=db, log_search=False, mode="lexical")
+        assert [r["title"] for r in results] == ["diffusion models"]
+        
+        results, _ = search_engine.search("diffusion", top_k=3, db=db, log_search=False, mode="hybrid")
+        assert results[0]["title"] == "diffusion models"
+        assert [r["rank"] for r in results] == [1, 2, 3]
+    
+    def test_repeated_search_is_served_from_cache(self, search_env):
+        from app.models import SearchLog
+        search_engine, db, _, encoded = search_env
+        first, _ = search_engine.search("diffusion models", top_k=2, db=db)
+        second, _ = search_engine.search("diffusion   models", top_k=2, db=db)
+        
+        assert second == first
+        assert encoded == ["diffusion models"]
+        search_engine.log_writer.close()
+        assert db.query(SearchLog).count() == 2
+    
+    def test_index_version_change_invalidates_cache(self, search_env):
+        search_engine, db, index, encoded = search_env
+        search_engine.search("transformers", top_k=2, db=db, log_search=False)
+        index.version += 1
+        search_engine.search("transformers", top_k=2, db=db, log_search=False)
+        assert len(encoded) == 2
+    
+    def test_filters_are_part_of_the_key(self, search_env):
+        search_engine, db, _, encoded = search_env
+        search_engine.search("transformers", top_k=2, db=db, log_search=False)
+        search_engine.search("transformers", top_k=2, db=db, log_search=False, categories=["cs.CL"])
+        assert len(encoded) == 2
+    
+    def test_results_come_from_metadata_store(self, search_env, monkeypatch):
+        search_engine, db, _, _ = search_env
+        expected, _ = search_engine.search("diffusion", top_k=4, db=db, log_search=False, mode="lexical")
+        search_engine.refresh_metadata_store(db.get_bind())
+        search_engine.response_cache.clear()
+        
+        def no_query(*args):
+            raise AssertionError("hit the database")
+        
+        monkeypatch.setattr(db, "query", no_query)
+        results, _ = search_engine.search("diffusion", top_k=4, db=db, log_search=False, mode="lexical")
+        assert results == expected
+    
+    def test_papers_missing_from_store_fall_back_to_database(self, search_env):
+        from app.models import Document
+        search_engine, db, index, _ = search_env
+        search_engine.refresh_metadata_store(db.get_bind())
+        
+        doc = Document(arxiv_id="2402.00001", title="new paper", abstract="Fresh off the press.")
+        db.add(doc)
+        db.flush()
+        doc.embedding_id = doc.id
+        db.commit()
+        index.add_embeddings(np.random.rand(1, 8).astype('float32'), [doc.id])
+        
+        results, _ = search_engine.search("anything", top_k=5, db=db, log_search=False)
+        assert "new paper" in [r["title"] for r in results]
+    
+    def test_batch_rerank_gives_each_query_a_budget(self, search_env, monkeypatch):
+        import retrieval.search as search_module
+        search_engine, db, _, _ = search_env
+        reranker = CrossEncoderReranker(model_name="test", batch_size=16, cache_size=100)
+        # 4 papers at 20 ms a pair: one query fits the 100 ms budget, three do not
+        reranker.model = FakeCrossEncoder(delay=0.02)
+        monkeypatch.setattr(search_module, "get_reranker", lambda: reranker)
+        monkeypatch.setattr(search_module.settings, "CROSS_ENCODER_BUDGET_MS", 100)
+        
+        all_results, _ = search_engine.search_batch(
+            ["diffusion", "transformers", "graphs"], top_k=4, db=db, log_search=False, mode="dense", rerank=True
+        )
+        
+        assert all(result["rerank_score"] is not None for results in all_results for result in results)
+        assert reranker.stats()["truncated_pairs"] == 0
+    
+    def test_stale_filter_index_rebuilds_in_background(self, search_env, monkeypatch):
+        import threading
+        import retrieval.search as search_module
+        search_engine, db, index, _ = search_env
+        first = search_engine.get_filter_index(db)
+        index.version += 1
+        
+        release = threading.Event()
+        build = search_module.FilterIndex
+        
+        def slow_build(*args, **kwargs):
+            release.wait(5)
+            return build(*args, **kwargs)
+        
+        monkeypatch.setattr(search_module, "FilterIndex", slow_build)
+        started = time.perf_counter()
+        assert search_engine.get_filter_index(db) is first
+        assert time.perf_counter() - started < 1
+        
+        release.set()
+        for _ in range(100):
+            if search_engine.get_filter_index(db).version == index.version:
+                break
+            time.sleep(0.02)
+        assert search_engine.get_filter_index(db).version == index.version
+    
+    def test_stage_timings_and_metrics(self, api_client):
+        client, _, _ = api_client
+        body = client.post("/search", json={"query": "diffusion", "mode": "hybrid", "debug": True}).json()
+        plain = client.post("/search", json={"query": "transformers"}).json()
+        metrics = client.get("/metrics").text
+        
+        assert {"encode", "faiss", "bm25", "fusion", "log"} <= set(body["timings_ms"])
+        assert plain["timings_ms"] is None
+        assert 'scholarscope_search_stage_seconds_count{stage="faiss"}' in metrics
+        assert 'scholarscope_search_queries_total{cache="miss",mode="hybrid"}' in metrics
+        assert "scholarscope_search_in_flight 0.0" in metrics
+    
+    def test_batch_endpoint_takes_per_query_top_k(self, api_client, monkeypatch):
+        from app.config import get_settings
+        client, search_engine, _ = api_client
+        calls = []
+        encode = search_engine.query_batcher.encode
+        monkeypatch.setattr(search_engine.query_batcher, "encode", lambda queries: calls.append(queries) or encode(queries))
+        queries = [
+            {"query": "diffusion", "top_k": 1},
+            {"query": "", "top_k": 2},
+            {"query": "transformers", "top_k": 3},
+            {"query": "graphs", "top_k": 500},
+        ]
+        body = client.post("/search/batch", json={"queries": queries, "mode": "dense"}).json()
+        too_many = client.post("/search/batch", json={"queries": [{"query": "q"}] * (get_settings().SEARCH_BATCH_MAX_QUERIES + 1)})
+        
+        assert [item["query"] for item in body["results"]] == ["diffusion", "", "transformers", "graphs"]
+        assert [item["total_results"] for item in body["results"]] == [1, 0, 3, 0]
+        assert [item["error"] is None for item in body["results"]] == [True, False, True, False]
+        assert body["failed_queries"] == 2
+        assert calls == [["diffusion", "transformers"]]
+        assert too_many.status_code == 422
+    
+    def test_batch_failure_is_reported_per_query(self, api_client, monkeypatch):
+        client, search_engine, _ = api_client
+        encode = search_engine.query_batcher.encode
+        
+        def failing_encode(queries):
+            if "boom" in queries:
+                raise RuntimeError("encoder exploded")
+            return encode(queries)
+        
+        monkeypatch.setattr(search_engine.query_batcher, "encode", failing_encode)
+        body = client.post("/search/batch", json={"queries": [{"query": "boom"}, {"query": "transformers"}], "mode": "dense"}).json()
+        
+        first, second = body["results"]
+        assert "encoder exploded" in first["error"]
+        assert second["error"] is None and second["total_results"] == 4
+    
+    def test_export_streams_and_pages_one_ranking(self, api_client, monkeypatch):
+        import json
+        import app.api as api_module
+        client, search_engine, encoded = api_client
+        monkeypatch.setattr(api_module.settings, "EXPORT_CHUNK_SIZE", 3)
+        export = {"query": "papers", "limit": 4, "page_size": 3, "mode": "dense"}
+        with client.stream("POST", "/search/export", json=export) as response:
+            assert response.headers["content-type"] == "application/x-ndjson"
+            assert response.headers["x-total-results"] == "4"
+            streamed = [json.loads(line) for line in response.iter_lines() if line]
+        
+        first = client.post("/search/pages", json=export).json()
+        second = client.get("/search/pages", params={"cursor": first["next_cursor"], "page_size": 3}).json()
+        malformed = client.get("/search/pages", params={"cursor": "nope"})
+        search_engine.ranked_ids.clear()
+        expired = client.get("/search/pages", params={"cursor": first["next_cursor"]})
+        
+        assert [r["rank"] for r in streamed] == [1, 2, 3, 4]
+        assert first["results"] + second["results"] == streamed
+        assert first["total_results"] == 4 and second["next_cursor"] is None
+        # the pages reuse the ranking the stream computed
+        assert encoded == ["papers"]
+        assert malformed.status_code == 400
+        assert expired.status_code == 410
+    
+    def test_health_checks_database(self, api_client):
+        client, _, _ = api_client
+        body = client.get("/health").json()
+        
+        assert body["database"] == "connected"
+        assert body["status"] == "healthy"
+
+
+class TestMetadataStore:
+    def test_rows_match_document_to_dict(self):
+        from app.models import Document
+        documents = [
+            Document(id=1, embedding_id=1, arxiv_id="2401.00001", title="Ünïcode títle", authors=None,
+                     abstract="", categories="cs.CL", published_date=datetime(2024, 1, 2, 3, 4, 5, 678), pdf_url=None),
+            Document(id=7, embedding_id=7, arxiv_id="2401.00007", title="Second", authors="A, B",
+                     abstract="Abstract text.", categories=None, published_date=None, pdf_url="http://x/7.pdf"),
+        ]
+        from retrieval.metadata_store import MetadataStore
+        store = MetadataStore(documents, version=3)
+        
+        assert len(store) == 2
+        for document in documents:
+            assert store.get(document.embedding_id) == document.to_dict()
+        assert store.get(4) is None
+        assert store.get(99) is None
+        assert set(store.get_many([1, 4, 7])) == {1, 7}
+
+
+class TestSearchLogWriter:
+    def make_db(self):
+        from sqlalchemy import create_engine
+        from sqlalchemy.pool import StaticPool
+        from app.models import Base
+        engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        Base.metadata.create_all(engine)
+        return engine
+    
+    def count(self, engine):
+        from sqlalchemy import text
+        with engine.connect() as conn:
+            return conn.execute(text("SELECT COUNT(*) FROM search_logs")).scalar()
+    
+    def test_batches_rows_and_flushes_on_close(self):
+        from retrieval.search_log import SearchLogWriter
+        engine = self.make_db()
+        writer = SearchLogWriter(engine, batch_size=4, flush_interval=60)
+        for i in range(10):
+            writer.log(f"query {i}", 5, 1.0, 5)
+        writer.close()
+        
+        assert self.count(engine) == 10
+        assert writer.stats()["written"] == 10
+        assert writer.batches == 3
+    
+    def test_flushes_after_interval(self):
+        from retrieval.search_log import SearchLogWriter
+        engine = self.make_db()
+        writer = SearchLogWriter(engine, batch_size=100, flush_interval=0.05)
+        writer.log("query", 5, 1.0, 5)
+        for _ in range(100):
+            if writer.written:
+                break
+            time.sleep(0.01)
+        assert self.count(engine) == 1
+        writer.close()
+    
+    def test_full_queue_drops_and_counts(self):
+        import threading
+        from retrieval.search_log import SearchLogWriter
+        writer = SearchLogWriter(self.make_db(), max_queue=2, batch_size=1, flush_interval=60)
+        release = threading.Event()
+        write = writer._write
+        writer._write = lambda rows: (release.wait(), write(rows))
+        
+        writer.log("in flight", 5, 1.0, 5)
+        for _ in range(100):
+            if writer._queue.empty():
+                break
+            time.sleep(0.01)
+        for i in range(5):
+            writer.log(f"query {i}", 5, 1.0, 5)
+        assert writer.dropped == 3
+        
+        release.set()
+        writer.close()
+        assert writer.written == 3
 
 
 class TestEmbeddingGenerator:
@@ -52,6 +797,300 @@ class TestEmbeddingGenerator:
         
         assert isinstance(embeddings, np.ndarray)
         assert embeddings.shape == (3, 384)
+    
+    def test_worker_pool_preserves_order(self, monkeypatch):
+        from ingestion import embeddings as embeddings_module
+        monkeypatch.setattr(embeddings_module, "WORKER_CHUNK_SIZE", 4)
+        texts = [f"Paper number {i} about retrieval" for i in range(10)]
+        
+        reference = EmbeddingGenerator(cache_path="").generate(texts)
+        generator = EmbeddingGenerator(cache_path="", num_workers=2)
+        try:
+            pooled = generator.generate(texts)
+        finally:
+            generator.close_pool()
+        
+        assert pooled.shape == reference.shape
+        assert np.allclose(pooled, reference, atol=1e-5)
+    
+    @pytest.mark.parametrize("backend,min_cosine", [("onnx", 0.999), ("onnx-int8", 0.97)])
+    def test_onnx_backend_parity(self, backend, min_cosine, tmp_path, monkeypatch):
+        pytest.importorskip("onnxruntime")
+        pytest.importorskip("optimum")
+        from ingestion import embeddings as embeddings_module
+        monkeypatch.setattr(embeddings_module.settings, "EMBEDDING_ONNX_DIR", str(tmp_path))
+        
+        texts = [
+            "Attention is all you need",
+            "We propose a graph neural network for molecular property prediction.",
+            "Retrieval-augmented generation grounds language models in external documents.",
+        ]
+        reference = EmbeddingGenerator(cache_path="").generate(texts)
+        candidate = EmbeddingGenerator(cache_path="", backend=backend).generate(texts)
+        
+        reference /= np.linalg.norm(reference, axis=1, keepdims=True)
+        candidate /= np.linalg.norm(candidate, axis=1, keepdims=True)
+        cosine = (reference * candidate).sum(axis=1)
+        assert cosine.min() >= min_cosine
+
+
+class FakeTokenizerModel:
+    max_seq_length = 256
+    
+    def __init__(self):
+        self.batches = []
+    
+    def tokenizer(self, texts, truncation=True, max_length=None):
+        return {"input_ids": [text.split()[:max_length] for text in texts]}
+    
+    def encode(self, texts, batch_size=32, **kwargs):
+        self.batches.append(len(texts))
+        return np.array([[float(len(text.split()))] * 3 for text in texts], dtype='float32')
+
+
+class TestTokenBudgetBatching:
+    def test_batches_respect_budget_and_cover_all_texts(self):
+        lengths = [10, 200, 15, 180, 12, 11, 250, 14]
+        batches = _token_budget_batches(lengths, max_tokens=400)
+        
+        for batch in batches:
+            assert max(lengths[i] for i in batch) * len(batch) <= 400
+        assert sorted(np.concatenate(batches).tolist()) == list(range(len(lengths)))
+    
+    def test_oversized_text_gets_its_own_batch(self):
+        batches = _token_budget_batches([500, 3, 3], max_tokens=100)
+        assert [len(batch) for batch in batches] == [1, 2]
+    
+    def test_encode_restores_input_order(self):
+        gen = EmbeddingGenerator(cache_path="", num_workers=1, batch_tokens=40)
+        gen.model = FakeTokenizerModel()
+        texts = [" ".join(["word"] * n) for n in [3, 30, 5, 12, 1, 25]]
+        
+        embeddings = gen.generate(texts)
+        
+        assert embeddings[:, 0].tolist() == [3, 30, 5, 12, 1, 25]
+        assert len(gen.model.batches) > 1
+
+
+class TestEmbeddingCache:
+    def test_round_trip_and_hit_rate(self, tmp_path):
+        cache = EmbeddingCache(str(tmp_path / "cache.sqlite"))
+        keys = [EmbeddingCache.make_key("model", text) for text in ["a", "b"]]
+        vectors = np.random.rand(2, 384).astype('float32')
+        
+        assert cache.get_many(keys) == {}
+        cache.put_many(keys, vectors)
+        found = cache.get_many(keys)
+        
+        np.testing.assert_array_equal(found[keys[1]], vectors[1])
+        assert cache.hit_rate == 0.5
+    
+    def test_key_depends_on_model(self):
+        assert EmbeddingCache.make_key("model-a", "text") != EmbeddingCache.make_key("model-b", "text")
+    
+    def test_evicts_least_recently_used(self, tmp_path):
+        cache = EmbeddingCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+        cache.put_many(["old"], np.zeros((1, 4), dtype='float32'))
+        cache.put_many(["new"], np.zeros((1, 4), dtype='float32'))
+        cache.get_many(["old"])
+        cache.put_many(["newest"], np.zeros((1, 4), dtype='float32'))
+        
+        assert set(cache.get_many(["old", "new", "newest"])) == {"old", "newest"}
+    
+    def test_cache_hits_skip_the_model(self, tmp_path, monkeypatch):
+        gen = EmbeddingGenerator(model_name="test-model", cache_path=str(tmp_path / "cache.sqlite"))
+        encoded = []
+        
+        def fake_encode(texts):
+            encoded.extend(texts)
+            return np.random.rand(len(texts), 384).astype('float32')
+        
+        monkeypatch.setattr(gen, "_encode", fake_encode)
+        first = gen.generate(["x", "y"], use_cache=True)
+        second = gen.generate(["y", "z", "x"], use_cache=True)
+        
+        assert encoded == ["x", "y", "z"]
+        np.testing.assert_array_equal(second[0], first[1])
+        np.testing.assert_array_equal(second[2], first[0])
+
+
+class TestQueryEmbeddingCache:
+    def test_lru_eviction_and_counters(self):
+        cache = QueryEmbeddingCache(max_size=2)
+        cache.put("a", np.zeros(3))
+        cache.put("b", np.ones(3))
+        assert cache.get("a") is not None
+        cache.put("c", np.ones(3))
+        
+        assert cache.get("b") is None
+        assert cache.get("c") is not None
+        assert cache.stats()["hits"] == 2
+        assert cache.stats()["misses"] == 1
+    
+    def test_expired_entries_miss(self, monkeypatch):
+        cache = QueryEmbeddingCache(max_size=4, ttl_seconds=10)
+        cache.put("a", np.zeros(3))
+        now = time.monotonic()
+        monkeypatch.setattr(time, "monotonic", lambda: now + 11)
+        
+        assert cache.get("a") is None
+    
+    def test_repeated_queries_skip_encoder_until_model_changes(self, monkeypatch):
+        gen = EmbeddingGenerator(model_name="test-model", cache_path="")
+        encoded = []
+        
+        def fake_generate(texts, use_cache=False):
+            encoded.extend(texts)
+            return np.random.rand(len(texts), 384).astype('float32')
+        
+        monkeypatch.setattr(gen, "generate", fake_generate)
+        first = gen.generate_query_embedding("graph  neural networks")
+        second = gen.generate_query_embeddings(["graph neural networks ", "transformers", "transformers"])
+        
+        assert encoded == ["graph neural networks", "transformers"]
+        np.testing.assert_array_equal(second[0], first)
+        
+        gen.set_model("other-model")
+        gen.generate_query_embedding("graph neural networks")
+        assert encoded[-1] == "graph neural networks"
+        assert len(encoded) == 3
+
+
+class FakeQueryEncoder:
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls = []
+    
+    def generate_query_embeddings(self, queries):
+        self.calls.append(list(queries))
+        time.sleep(self.delay)
+        if "boom" in queries:
+            raise RuntimeError("encoder failed")
+        return np.array([[float(len(query))] * 3 for query in queries], dtype='float32')
+
+
+class TestQueryBatcher:
+    def test_concurrent_queries_share_one_pass(self):
+        from concurrent.futures import ThreadPoolExecutor
+        encoder = FakeQueryEncoder()
+        batcher = QueryBatcher(encoder, window_ms=200, max_batch_size=64)
+        queries = [["a" * n] for n in range(1, 9)]
+        
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(batcher.encode, queries))
+        
+        for query, vectors in zip(queries, results):
+            assert vectors.shape == (1, 3)
+            assert vectors[0, 0] == len(query[0])
+        assert len(encoder.calls) < len(queries)
+        stats = batcher.stats()
+        assert stats["queries"] == 8
+        assert stats["batches"] == len(encoder.calls)
+        assert stats["max_batch_seen"] > 1
+    
+    def test_max_batch_size_splits_batches(self):
+        from concurrent.futures import ThreadPoolExecutor
+        encoder = FakeQueryEncoder(delay=0.05)
+        batcher = QueryBatcher(encoder, window_ms=100, max_batch_size=2)
+        
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            list(pool.map(batcher.encode, [["q%d" % i] for i in range(6)]))
+        
+        assert all(len(call) <= 2 for call in encoder.calls)
+        assert sum(len(call) for call in encoder.calls) == 6
+    
+    def test_errors_reach_every_caller_in_the_batch(self):
+        batcher = QueryBatcher(FakeQueryEncoder(), window_ms=1)
+        with pytest.raises(RuntimeError):
+            batcher.encode(["boom"])
+        assert batcher.encode(["ok"]).shape == (1, 3)
+    
+    def test_zero_window_encodes_directly(self):
+        encoder = FakeQueryEncoder()
+        batcher = QueryBatcher(encoder, window_ms=0)
+        batcher.encode(["a", "bb"])
+        assert encoder.calls == [["a", "bb"]]
+        assert batcher._worker is None
+
+
+class FakeWarmupEngine:
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.ready = False
+        self.log_writer = None
+    
+    def warmup(self, db=None):
+        time.sleep(0.1)
+        if self.fail:
+            raise RuntimeError("index missing")
+        self.ready = True
+
+
+class TestStartup:
+    def test_api_import_skips_heavy_modules(self):
+        import subprocess
+        import sys
+        code = "import sys, app.api; print(any(m in sys.modules for m in ('torch', 'sentence_transformers', 'faiss')))"
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+        assert output.strip() == "False"
+    
+    @pytest.mark.parametrize("fail,status", [(False, "ready"), (True, "failed")])
+    def test_ready_reports_warmup(self, fail, status, monkeypatch):
+        from fastapi.testclient import TestClient
+        import app.api as api_module
+        engine = FakeWarmupEngine(fail=fail)
+        monkeypatch.setattr(api_module, "get_search_engine", lambda: engine)
+        monkeypatch.setattr(api_module, "_warmup_error", None)
+        monkeypatch.setattr(api_module.settings, "WARMUP_ON_STARTUP", True)
+        
+        with TestClient(api_module.app) as client:
+            assert client.get("/ready").json() == {"status": "warming_up"}
+            for _ in range(50):
+                response = client.get("/ready")
+                if response.json()["status"] != "warming_up":
+                    break
+                time.sleep(0.05)
+        
+        assert response.json()["status"] == status
+        assert response.status_code == (503 if fail else 200)
+
+
+class TestRequestPool:
+    def test_sheds_once_queue_is_full(self):
+        import asyncio
+        import threading
+        from app.concurrency import Overloaded, RequestPool
+        pool = RequestPool(workers=1, max_queued=1)
+        release = threading.Event()
+        
+        async def scenario():
+            running = asyncio.ensure_future(pool.run(release.wait))
+            queued = asyncio.ensure_future(pool.run(lambda: "queued"))
+            await asyncio.sleep(0.05)
+            assert pool.queued == 1
+            with pytest.raises(Overloaded) as shed:
+                await pool.run(lambda: "shed")
+            release.set()
+            return await running, await queued, shed.value.retry_after
+        
+        first, second, retry_after = asyncio.run(scenario())
+        
+        assert (first, second) == (True, "queued")
+        assert retry_after >= 1
+        assert pool.stats()["shed"] == 1
+        assert pool.active == 0
+    
+    def test_api_returns_503_with_retry_after(self, api_client, monkeypatch):
+        import app.api as api_module
+        from app.concurrency import RequestPool
+        client, _, _ = api_client
+        pool = RequestPool(workers=1, max_queued=0)
+        pool.active = 1
+        monkeypatch.setattr(api_module, "search_pool", pool)
+        response = client.post("/search", json={"query": "diffusion"})
+        
+        assert response.status_code == 503
+        assert int(response.headers["Retry-After"]) >= 1
 
 
 if __name__ == "__main__":